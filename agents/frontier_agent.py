@@ -1,10 +1,13 @@
 from agents.base import Agent
+from typing import List, Optional
 from utils.rag_pipeline_handler import (
     VectorDbManager,
     RagPipelineHandler,
 )
 
 VECTOR_DB_PATH = "vector_db"
+# Exported with python -m utils.index_snapshot, loaded by nodes without a vector db
+INDEX_SNAPSHOT_PATH = "vector_db.snapshot"
 VECTOR_DB_COLLECTION_NAME = "products"
 EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 RAW_DATASET_NAME = "rushil180101/ai-pricer-project-preprocessed"
@@ -26,10 +29,27 @@ class FrontierAgent(Agent):
             raw_dataset_name=RAW_DATASET_NAME,
             vector_db_manager=self.vector_db_manager,
             chat_model_name=CHAT_MODEL_NAME,
+            index_snapshot_path=INDEX_SNAPSHOT_PATH,
         )
 
+    def warmup(self) -> None:
+        # The embedder and vector db are otherwise loaded by the first price call
+        self.rag_pipeline_handler.warmup()
+        self.logger.info(f"{self.name} warmed up")
+
+    def get_price_estimator_stats(self) -> dict:
+        # Share of prices estimated from similar products without an llm call
+        # and their difference to the llm prices of shadowed requests
+        return self.rag_pipeline_handler.price_estimator.get_stats()
+
     def price(self, description: str) -> float:
         self.logger.info(f"{self.name} called, predicting price of the product")
         price = self.rag_pipeline_handler.chat(description)
         self.logger.info(f"{self.name} predicted price is ${price}")
         return price
+
+    def price_batch(self, descriptions: List[str]) -> List[Optional[float]]:
+        self.logger.info(f"{self.name} called, predicting {len(descriptions)} prices")
+        prices = self.rag_pipeline_handler.chat_batch(descriptions)
+        self.logger.info(f"{self.name} predicted prices are {prices}")
+        return prices
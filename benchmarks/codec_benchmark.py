@@ -0,0 +1,137 @@
+import argparse
+import json
+import random
+import time
+from dataset.preprocessor import (
+    PREPROCESSING_MAX_TOKENS,
+    PREPROCESSING_MODEL,
+    TEXT_PREPROCESSING_SYSTEM_PROMPT,
+)
+from models.codec import decode_items, encode_batch_request, encode_items
+from models.item import Item
+
+WORDS = [
+    "wireless",
+    "bluetooth",
+    "speaker",
+    "portable",
+    "battery",
+    "charging",
+    "cable",
+    "durable",
+    "premium",
+    "sound",
+    "café",
+]
+
+
+def make_sentence(rng: random.Random, min_words: int, max_words: int) -> str:
+    return " ".join(rng.choices(WORDS, k=rng.randint(min_words, max_words)))
+
+
+def make_item(rng: random.Random, index: int) -> Item:
+    return Item(
+        item_id=f"raw_meta_Electronics-{index:016x}",
+        title=make_sentence(rng, 3, 8),
+        category="raw_meta_Electronics",
+        description=make_sentence(rng, 20, 120),
+        price=round(rng.uniform(0.5, 999), 2),
+        summary=make_sentence(rng, 10, 40),
+    )
+
+
+def encode_items_dataclasses_json(items: list) -> bytes:
+    return "".join(f"{json.dumps(item.to_dict())}\n" for item in items).encode()
+
+
+def decode_items_dataclasses_json(data: bytes) -> list:
+    return [Item.from_json(line) for line in data.decode().splitlines()]
+
+
+def make_batch_request_line_dataclasses_json(item: Item) -> str:
+    body = {
+        "model": PREPROCESSING_MODEL,
+        "messages": [
+            {"role": "system", "content": TEXT_PREPROCESSING_SYSTEM_PROMPT},
+            {"role": "user", "content": item.to_json()},
+        ],
+        "max_tokens": PREPROCESSING_MAX_TOKENS,
+    }
+    line = {
+        "custom_id": str(item.item_id),
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": body,
+    }
+    return json.dumps(line)
+
+
+def make_batch_request_line_codec(item: Item) -> str:
+    # DatasetPreprocessor.make_batch_request_line
+    return encode_batch_request(
+        model=PREPROCESSING_MODEL,
+        system_prompt=TEXT_PREPROCESSING_SYSTEM_PROMPT,
+        item=item,
+        max_tokens=PREPROCESSING_MAX_TOKENS,
+    )
+
+
+def parse_batch_request_line(line: str) -> dict:
+    # The item in the user message is compared as data, not as text
+    request = json.loads(line)
+    message = request["body"]["messages"][1]
+    message["content"] = json.loads(message["content"])
+    return request
+
+
+def make_batch_request_lines(make_line, items: list) -> list:
+    # Lines are made one item at a time, as they are written to the shards
+    return [make_line(item) for item in items]
+
+
+def timed(fn, *args) -> tuple:
+    started_at = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started_at
+
+
+def report(label: str, rows: int, current: float, codec: float) -> None:
+    print(
+        f"{label:<15}: dataclasses_json {rows / current:>10,.0f} rows/s, "
+        f"codec {rows / codec:>10,.0f} rows/s ({current / codec:.1f}x)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="dataclasses_json vs codec")
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    items = [make_item(rng, index) for index in range(args.rows)]
+
+    current_data, current = timed(encode_items_dataclasses_json, items)
+    codec_data, codec = timed(encode_items, items)
+    report("encode items", args.rows, current, codec)
+
+    current_items, current = timed(decode_items_dataclasses_json, current_data)
+    codec_items, codec = timed(decode_items, codec_data)
+    report("decode items", args.rows, current, codec)
+    if current_items != codec_items:
+        print("decode items   : output differs from dataclasses_json")
+
+    current_lines, current = timed(
+        make_batch_request_lines, make_batch_request_line_dataclasses_json, items
+    )
+    codec_lines, codec = timed(
+        make_batch_request_lines, make_batch_request_line_codec, items
+    )
+    report("batch requests", args.rows, current, codec)
+    if list(map(parse_batch_request_line, current_lines)) != list(
+        map(parse_batch_request_line, codec_lines)
+    ):
+        print("batch requests : output differs from dataclasses_json")
+
+
+if __name__ == "__main__":
+    main()
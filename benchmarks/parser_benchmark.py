@@ -0,0 +1,109 @@
+import argparse
+import json
+import random
+import time
+from datasets import Dataset
+from dataset.parser import parse, parse_batch
+
+CATEGORY = "raw_meta_Electronics"
+WORDS = [
+    "wireless",
+    "bluetooth",
+    "speaker",
+    "portable",
+    "battery",
+    "charging",
+    "cable",
+    "durable",
+    "(black)",
+    "[2-pack]",
+    "premium",
+    "sound",
+    "compatible",
+    "with",
+    "design",
+    "café",
+]
+
+
+def make_sentence(rng: random.Random, min_words: int, max_words: int) -> str:
+    return " ".join(rng.choices(WORDS, k=rng.randint(min_words, max_words)))
+
+
+def make_datapoint(rng: random.Random) -> dict:
+    price = rng.choice(
+        ["None", f"{rng.uniform(0.1, 1500):.2f}", str(rng.randint(1, 900))]
+    )
+    details = {
+        "Brand": make_sentence(rng, 1, 2),
+        "Item Weight": f"{rng.randint(1, 50)} ounces",
+        "Item model number": str(rng.randint(1000, 9999)),
+    }
+    features = [make_sentence(rng, 5, 30) for _ in range(rng.randint(0, 6))]
+    description = [make_sentence(rng, 10, 60) for _ in range(rng.randint(0, 3))]
+    return {
+        "title": make_sentence(rng, 3, 8),
+        "price": price,
+        "features": features,
+        "description": description,
+        "details": json.dumps(details),
+    }
+
+
+FIELDS = ["item_id", "title", "category", "description", "price"]
+
+
+def run_per_row(datapoints: list) -> list:
+    items = [parse(datapoint=dp, category=CATEGORY) for dp in datapoints]
+    return [item.to_dict() for item in items if item is not None]
+
+
+def same_items(result: list, expected: list) -> bool:
+    result = [[item[field] for field in FIELDS] for item in result]
+    expected = [[item[field] for field in FIELDS] for item in expected]
+    return result == expected
+
+
+def run_batched(dataset: Dataset, num_proc: int, batch_size: int) -> list:
+    parsed_dataset = dataset.with_format("arrow").map(
+        parse_batch,
+        batched=True,
+        batch_size=batch_size,
+        num_proc=num_proc if num_proc > 1 else None,
+        remove_columns=dataset.column_names,
+        fn_kwargs={"category": CATEGORY},
+        load_from_cache_file=False,
+    )
+    return parsed_dataset.with_format(None).to_list()
+
+
+def timed(fn, *args) -> tuple:
+    started_at = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started_at
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-row vs batched parser")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--num-proc", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    datapoints = [make_datapoint(rng) for _ in range(args.rows)]
+    dataset = Dataset.from_list(datapoints)
+
+    expected, seconds = timed(run_per_row, datapoints)
+    print(f"per-row    : {args.rows / seconds:>10,.0f} rows/s")
+
+    for num_proc in args.num_proc:
+        result, seconds = timed(run_batched, dataset, num_proc, args.batch_size)
+        label = f"batched x{num_proc}"
+        print(f"{label:<11}: {args.rows / seconds:>10,.0f} rows/s")
+        if not same_items(result, expected):
+            print(f"{label:<11}: output differs from per-row parser")
+
+
+if __name__ == "__main__":
+    main()
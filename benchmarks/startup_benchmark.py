@@ -0,0 +1,34 @@
+import argparse
+import importlib
+import time
+
+
+def timed(fn, *args) -> tuple:
+    started_at = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started_at
+
+
+def main() -> None:
+    # Run in a fresh process, modules imported earlier are not timed again
+    parser = argparse.ArgumentParser(description="Frontier agent startup time")
+    parser.add_argument(
+        "--warmup",
+        action="store_true",
+        help="also load the embedder and vector db (and ingest if needed)",
+    )
+    args = parser.parse_args()
+
+    module, seconds = timed(importlib.import_module, "agents.frontier_agent")
+    print(f"import       : {seconds:>7.3f}s")
+
+    agent, seconds = timed(module.FrontierAgent)
+    print(f"construction : {seconds:>7.3f}s")
+
+    if args.warmup:
+        _, seconds = timed(agent.warmup)
+        print(f"warmup       : {seconds:>7.3f}s")
+
+
+if __name__ == "__main__":
+    main()
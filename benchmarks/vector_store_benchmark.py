@@ -0,0 +1,129 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from utils.vector_store import (
+    CHROMA_BACKEND,
+    DEFAULT_STORAGE,
+    STORAGE_DTYPES,
+    VECTOR_STORE_BACKENDS,
+    make_vector_store,
+)
+
+COLLECTION_NAME = "products"
+UPSERT_BATCH_SIZE = 5000
+
+
+def make_embeddings(rng: np.random.Generator, rows: int, dimension: int) -> tuple:
+    # Clustered vectors, so that neighbours are not all equally far apart
+    centers = rng.normal(size=(max(rows // 50, 1), dimension))
+    embeddings = centers[rng.integers(0, len(centers), rows)]
+    embeddings = embeddings + 0.3 * rng.normal(size=(rows, dimension))
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings.astype(np.float32), centers
+
+
+def exact_neighbours(embeddings: np.ndarray, queries: np.ndarray, k: int) -> list:
+    scores = queries.astype(np.float64) @ embeddings.astype(np.float64).T
+    return [set(np.argsort(-row)[:k]) for row in scores]
+
+
+def directory_bytes(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, file_name))
+        for root, _, file_names in os.walk(path)
+        for file_name in file_names
+    )
+
+
+def run_backend(
+    backend: str, storage: str, embeddings: np.ndarray, queries: np.ndarray, k: int
+) -> tuple:
+    path = tempfile.mkdtemp(prefix=f"{backend}_store_")
+    try:
+        store = make_vector_store(backend, path, COLLECTION_NAME, storage)
+        started_at = time.perf_counter()
+        for start in range(0, len(embeddings), UPSERT_BATCH_SIZE):
+            rows = range(start, min(start + UPSERT_BATCH_SIZE, len(embeddings)))
+            store.upsert(
+                ids=[f"{row:064d}" for row in rows],
+                embeddings=embeddings[start : rows.stop],
+                documents=[str(row) for row in rows],
+            )
+        ingest_seconds = time.perf_counter() - started_at
+        index_bytes = directory_bytes(path)
+        # Bytes scanned by every query, quantized numpy stores also keep a
+        # float32 copy on disk that is only read for the shortlist
+        searched_bytes = index_bytes
+        if backend != CHROMA_BACKEND:
+            searched_bytes = store.embeddings.nbytes
+            if store.scales is not None:
+                searched_bytes += store.scales.nbytes
+
+        latencies, results = [], []
+        for query in queries:
+            started_at = time.perf_counter()
+            documents = store.query(query[None, :], k)[0]
+            latencies.append(time.perf_counter() - started_at)
+            results.append({int(document) for document in documents})
+        return (
+            ingest_seconds,
+            index_bytes,
+            searched_bytes,
+            np.array(latencies),
+            results,
+        )
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Vector store backends")
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument(
+        "--backends", nargs="+", default=VECTOR_STORE_BACKENDS
+    )
+    parser.add_argument(
+        "--storage",
+        nargs="+",
+        default=list(STORAGE_DTYPES),
+        help="embedding storage of the numpy backend",
+    )
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    embeddings, _ = make_embeddings(rng, args.rows, args.dimension)
+    queries = embeddings[rng.integers(0, args.rows, args.queries)]
+    queries = queries + 0.1 * rng.normal(size=queries.shape).astype(np.float32)
+    expected = exact_neighbours(embeddings, queries, args.k)
+
+    for backend in args.backends:
+        storages = [DEFAULT_STORAGE] if backend == CHROMA_BACKEND else args.storage
+        for storage in storages:
+            ingest_seconds, index_bytes, searched_bytes, latencies, results = (
+                run_backend(backend, storage, embeddings, queries, args.k)
+            )
+            recall = np.mean(
+                [
+                    len(result & exact) / args.k
+                    for result, exact in zip(results, expected)
+                ]
+            )
+            label = f"{backend}/{storage}"
+            print(
+                f"{label:<14}: ingest {ingest_seconds:>6.1f}s, "
+                f"index {index_bytes / 1e6:>7.1f}MB "
+                f"(searched {searched_bytes / 1e6:>6.1f}MB), "
+                f"query p50 {np.percentile(latencies, 50) * 1000:>7.2f}ms, "
+                f"p95 {np.percentile(latencies, 95) * 1000:>7.2f}ms, "
+                f"recall@{args.k} {recall:.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
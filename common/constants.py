@@ -13,5 +13,7 @@ OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-LOCAL_OLLAMA_BASE_URL = "http://localhost:11434"
+# OpenAI compatible endpoint of the local ollama server
+LOCAL_OLLAMA_BASE_URL = "http://localhost:11434/v1"
+LOCAL_OLLAMA_API_KEY = "ollama"
 LOCAL_OLLAMA_MODEL = "gemma:1b"
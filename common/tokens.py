@@ -0,0 +1,25 @@
+import functools
+import tiktoken
+from typing import List
+
+# Encoding used by gpt-4.1 family models
+TOKEN_ENCODING_NAME = "o200k_base"
+# Tokens added by the chat format around every message and the reply
+MESSAGE_TOKEN_OVERHEAD = 3
+REPLY_TOKEN_OVERHEAD = 3
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = TOKEN_ENCODING_NAME) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(encoding_name)
+
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: List[dict]) -> int:
+    tokens = REPLY_TOKEN_OVERHEAD
+    for message in messages:
+        tokens += MESSAGE_TOKEN_OVERHEAD + count_tokens(message["content"])
+    return tokens
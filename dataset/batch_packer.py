@@ -0,0 +1,58 @@
+from common.tokens import count_message_tokens
+from typing import Iterable, Iterator, Tuple
+
+# Batch API limits per input file
+MAX_REQUESTS_PER_BATCH_FILE = 50_000
+MAX_BATCH_FILE_BYTES = 200_000_000
+
+
+def estimate_request_tokens(request: dict) -> int:
+    # Prompt tokens of a batch request line, as counted against enqueued limits
+    return count_message_tokens(request["body"]["messages"])
+
+
+class BatchPacker:
+
+    def __init__(
+        self,
+        max_tokens: int,
+        max_requests: int = MAX_REQUESTS_PER_BATCH_FILE,
+        max_bytes: int = MAX_BATCH_FILE_BYTES,
+        name_prefix: str = "batch",
+    ) -> None:
+        self.max_tokens = max_tokens
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.name_prefix = name_prefix
+
+    def pack(
+        self, requests: Iterable[Tuple[str, dict]]
+    ) -> Iterator[Tuple[str, bytes, int]]:
+        # Packs (line, request) pairs into batch files of at most max_tokens
+        # estimated prompt tokens, yields (file name, content, tokens)
+        file_index = 0
+        lines, tokens, size = [], 0, 0
+        for line, request in requests:
+            line_tokens = estimate_request_tokens(request)
+            line_size = len(line.encode("utf-8")) + 1
+            if lines and (
+                tokens + line_tokens > self.max_tokens
+                or len(lines) >= self.max_requests
+                or size + line_size > self.max_bytes
+            ):
+                yield self.make_batch_file(file_index, lines, tokens)
+                file_index += 1
+                lines, tokens, size = [], 0, 0
+            lines.append(line)
+            tokens += line_tokens
+            size += line_size
+
+        if lines:
+            yield self.make_batch_file(file_index, lines, tokens)
+
+    def make_batch_file(
+        self, file_index: int, lines: list, tokens: int
+    ) -> Tuple[str, bytes, int]:
+        file_name = f"{self.name_prefix}_{file_index:05d}.jsonl"
+        content = ("\n".join(lines) + "\n").encode("utf-8")
+        return file_name, content, tokens
@@ -0,0 +1,150 @@
+import concurrent.futures
+import time
+from common.loggers import dataset_logger as logger
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+MAX_IN_FLIGHT_BATCHES = 2
+# Organisation wide limit on enqueued prompt tokens, None for no limit
+MAX_IN_FLIGHT_TOKENS = None
+POLL_INTERVAL = 5
+MAX_POLL_INTERVAL = 60
+POLL_BACKOFF = 1.5
+FAILED_BATCH_STATUSES = {"failed", "expired", "cancelled"}
+# Failed and expired batches are created again from the same input file
+RETRY_BATCH_STATUSES = {"failed", "expired"}
+MAX_BATCH_RETRIES = 2
+
+
+class BatchScheduler:
+
+    def __init__(
+        self,
+        openai_client: Any,
+        max_in_flight: int = MAX_IN_FLIGHT_BATCHES,
+        max_in_flight_tokens: Optional[int] = MAX_IN_FLIGHT_TOKENS,
+        poll_interval: float = POLL_INTERVAL,
+        max_poll_interval: float = MAX_POLL_INTERVAL,
+        poll_backoff: float = POLL_BACKOFF,
+        max_retries: int = MAX_BATCH_RETRIES,
+    ) -> None:
+        self.openai_client = openai_client
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_tokens = max_in_flight_tokens
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_backoff = poll_backoff
+        self.max_retries = max_retries
+
+    def wait_for_batch(self, batch_id: str) -> Any:
+        # Polls with backoff until the batch is completed or failed
+        interval = self.poll_interval
+        result = self.openai_client.batches.retrieve(batch_id=batch_id)
+        while result.status != "completed":
+            if result.status in FAILED_BATCH_STATUSES:
+                logger.info(f"Batch {batch_id} {result.status}: {result.errors}")
+                return result
+
+            time.sleep(interval)
+            interval = min(interval * self.poll_backoff, self.max_poll_interval)
+            result = self.openai_client.batches.retrieve(batch_id=batch_id)
+        return result
+
+    def get_retry_delay(self, attempt: int) -> float:
+        delay = self.poll_interval * self.poll_backoff**attempt
+        return min(delay, self.max_poll_interval)
+
+    def run_batch(self, file_name: str, content: bytes) -> Optional[bytes]:
+        # Full lifecycle of one batch: upload, create, poll and download.
+        # A failed or expired batch is created again, after a growing delay,
+        # up to max_retries times.
+        response = self.openai_client.files.create(
+            file=(file_name, content), purpose="batch"
+        )
+        input_file_id = response.id
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                delay = self.get_retry_delay(attempt)
+                logger.info(f"Retrying {file_name} in {delay:.0f}s, attempt {attempt}")
+                time.sleep(delay)
+            response = self.openai_client.batches.create(
+                completion_window="24h",
+                endpoint="/v1/chat/completions",
+                input_file_id=input_file_id,
+            )
+            batch_id = response.id
+            logger.info(f"Created batch {batch_id} for {file_name}")
+
+            result = self.wait_for_batch(batch_id)
+            if result.status == "completed":
+                response = self.openai_client.files.content(
+                    file_id=result.output_file_id
+                )
+                return response.content
+            if result.status not in RETRY_BATCH_STATUSES:
+                break
+        return None
+
+    def fits_in_flight(self, tokens: int, in_flight_tokens: int) -> bool:
+        if self.max_in_flight_tokens is None or in_flight_tokens == 0:
+            # A single batch above the limit still runs, on its own
+            return True
+        return in_flight_tokens + tokens <= self.max_in_flight_tokens
+
+    def run(
+        self,
+        batch_files: Iterable[Tuple[str, bytes, int]],
+        on_result: Callable[[str, bytes], None],
+    ) -> Dict[str, int]:
+        # Keeps up to max_in_flight batches (and max_in_flight_tokens tokens)
+        # running and starts the next one as soon as any of them finishes.
+        # on_result runs in the calling thread.
+        stats = {"completed": 0, "failed": 0, "tokens": 0}
+        batch_files = iter(batch_files)
+        next_batch_file = next(batch_files, None)
+        pending = {}
+        in_flight_tokens = 0
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_in_flight
+        ) as tpx:
+            while True:
+                while (
+                    next_batch_file is not None
+                    and len(pending) < self.max_in_flight
+                    and self.fits_in_flight(next_batch_file[2], in_flight_tokens)
+                ):
+                    file_name, content, tokens = next_batch_file
+                    future = tpx.submit(self.run_batch, file_name, content)
+                    pending[future] = (file_name, tokens)
+                    in_flight_tokens += tokens
+                    next_batch_file = next(batch_files, None)
+                if not pending:
+                    break
+
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    file_name, tokens = pending.pop(future)
+                    in_flight_tokens -= tokens
+                    try:
+                        content = future.result()
+                    except Exception as exc:
+                        logger.info(f"Failed to process {file_name}, error: {exc}")
+                        content = None
+                    if content is None:
+                        stats["failed"] += 1
+                        continue
+                    try:
+                        on_result(file_name, content)
+                    except Exception as exc:
+                        logger.info(f"Failed to store {file_name}, error: {exc}")
+                        stats["failed"] += 1
+                        continue
+                    stats["completed"] += 1
+                    stats["tokens"] += tokens
+
+        logger.info(
+            f"Preprocessed {stats['completed']} batches ({stats['tokens']} tokens), "
+            f"{stats['failed']} failed"
+        )
+        return stats
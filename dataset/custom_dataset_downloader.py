@@ -1,11 +1,51 @@
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Optional
 from common.constants import HF_TOKEN
-from huggingface_hub import login
-from datasets import Dataset, load_dataset
+from huggingface_hub import HfApi, login
+from datasets import Dataset, DatasetDict, load_dataset, load_from_disk
+from common.loggers import dataset_logger as logger
 
+# Downloaded datasets are saved here as arrow files per revision and loaded
+# memory mapped afterwards, without logging in or reaching the hub
+CUSTOM_DATASET_CACHE_DIR = ".dataset_cache"
+PINNED_REVISION_FILE = "revision.json"
+PARTIAL_SUFFIX = ".partial"
 
-def download_custom_dataset(hf_dataset_repo: str) -> Dataset:
-    login(token=HF_TOKEN, add_to_git_credential=True)
-    dataset = load_dataset(hf_dataset_repo)
+
+def get_dataset_cache_dir(hf_dataset_repo: str) -> Path:
+    return Path(CUSTOM_DATASET_CACHE_DIR) / hf_dataset_repo.replace("/", "__")
+
+
+def read_pinned_revision(hf_dataset_repo: str) -> Optional[str]:
+    revision_file = get_dataset_cache_dir(hf_dataset_repo) / PINNED_REVISION_FILE
+    if not revision_file.exists():
+        return None
+    with open(revision_file, "r") as f:
+        return json.load(f)["revision"]
+
+
+def write_pinned_revision(hf_dataset_repo: str, revision: str) -> None:
+    revision_file = get_dataset_cache_dir(hf_dataset_repo) / PINNED_REVISION_FILE
+    partial_revision_file = Path(f"{revision_file}{PARTIAL_SUFFIX}")
+    with open(partial_revision_file, "w") as f:
+        json.dump({"repo_id": hf_dataset_repo, "revision": revision}, f)
+    os.replace(partial_revision_file, revision_file)
+
+
+def save_dataset(dataset: DatasetDict, revision_cache_dir: Path) -> None:
+    # Saved to a sibling directory and moved in place, so an interrupted save
+    # never leaves a partial dataset where a complete one is expected
+    partial_cache_dir = Path(f"{revision_cache_dir}{PARTIAL_SUFFIX}")
+    shutil.rmtree(partial_cache_dir, ignore_errors=True)
+    dataset.save_to_disk(str(partial_cache_dir))
+    shutil.rmtree(revision_cache_dir, ignore_errors=True)
+    os.replace(partial_cache_dir, revision_cache_dir)
+
+
+def validate_dataset(dataset: DatasetDict) -> None:
     # Basic validation
     required_splits = {"train", "validation", "test"}
     missing = required_splits - set(dataset.keys())
@@ -14,4 +54,34 @@ def download_custom_dataset(hf_dataset_repo: str) -> Dataset:
             f"Dataset is missing required splits: {missing}. "
             f"Available splits: {list(dataset.keys())}"
         )
-    return dataset
+
+
+def download_custom_dataset(
+    hf_dataset_repo: str,
+    revision: Optional[str] = None,
+    refresh: bool = False,
+) -> Dataset:
+    # Without an explicit revision the revision pinned by the last download
+    # is used, refresh=True looks up the latest revision on the hub instead
+    if revision is None and not refresh:
+        revision = read_pinned_revision(hf_dataset_repo)
+
+    if revision is not None:
+        revision_cache_dir = get_dataset_cache_dir(hf_dataset_repo) / revision
+        if (revision_cache_dir / "dataset_dict.json").exists():
+            dataset = load_from_disk(str(revision_cache_dir))
+            validate_dataset(dataset)
+            logger.info(f"Loaded {hf_dataset_repo}@{revision} from local cache")
+            return dataset
+
+    login(token=HF_TOKEN, add_to_git_credential=True)
+    if revision is None:
+        revision = HfApi().dataset_info(hf_dataset_repo).sha
+    dataset = load_dataset(hf_dataset_repo, revision=revision)
+    validate_dataset(dataset)
+
+    revision_cache_dir = get_dataset_cache_dir(hf_dataset_repo) / revision
+    save_dataset(dataset, revision_cache_dir)
+    write_pinned_revision(hf_dataset_repo, revision)
+    logger.info(f"Cached {hf_dataset_repo}@{revision} in {revision_cache_dir}")
+    return load_from_disk(str(revision_cache_dir))
@@ -1,9 +1,15 @@
+import concurrent.futures
+import json
+import time
 from datasets import load_dataset
 from huggingface_hub import login
 from common.constants import HF_TOKEN
-from dataset.parser import parse
+from dataset.deduplicator import NearDuplicateFilter
+from dataset.parser import parse, parse_batch
 from dataset.preprocessor import DatasetPreprocessor
-from typing import Any, List
+from dataset.shards import ShardWriter, open_shard, read_manifest
+from models.item import Item
+from typing import Any, Dict, Iterable, List
 from common.loggers import dataset_logger as logger
 
 DATASET_NAME = "McAuley-Lab/Amazon-Reviews-2023"
@@ -18,19 +24,61 @@ DATASET_CATEGORIES = [
     "Toys_and_Games",
 ]
 BATCH_SIZE = 250
+# Batch files rotate after BATCH_SIZE rows or MAX_SHARD_BYTES bytes (if set),
+# compression can be None, "gzip" or "zstd"
+MAX_SHARD_BYTES = None
+SHARD_COMPRESSION = None
 MAX_DATAPOINTS_PER_CATEGORY = 500
 SHOULD_PREPROCESS_DATA = True
+# Categories are downloaded in a process pool when more than one worker is set
+NUM_WORKERS = 1
+PROGRESS_LOG_INTERVAL = 1000
+# Streaming parses row by row, otherwise categories are downloaded in full
+# and parsed in arrow batches with NUM_PROC processes
+SHOULD_STREAM_DATASET = True
+NUM_PROC = 4
+PARSE_BATCH_SIZE = 1000
+# Categories completed by an earlier run are skipped and interrupted ones
+# continue after their last written batch file (see <category>.manifest.json)
+SHOULD_RESUME_DOWNLOAD = True
+# Near duplicate items (e.g. colour or size variants) within a category are
+# dropped before they are written, see dataset/deduplicator.py
+SHOULD_DROP_NEAR_DUPLICATES = True
+NEAR_DUPLICATE_THRESHOLD = 0.8
 
 
 class DatasetHandler:
 
-    def __init__(self, hf_dataset_path: str, dataset_categories: List[str]) -> None:
+    def __init__(
+        self,
+        hf_dataset_path: str,
+        dataset_categories: List[str],
+        num_workers: int = NUM_WORKERS,
+        streaming: bool = SHOULD_STREAM_DATASET,
+        num_proc: int = NUM_PROC,
+        should_resume: bool = SHOULD_RESUME_DOWNLOAD,
+    ) -> None:
         self.hf_dataset_path = hf_dataset_path
         self.dataset_categories = dataset_categories
+        self.num_workers = num_workers
+        self.streaming = streaming
+        self.num_proc = num_proc
+        self.should_resume = should_resume
+        self.should_drop_near_duplicates = SHOULD_DROP_NEAR_DUPLICATES
+        self.near_duplicate_threshold = NEAR_DUPLICATE_THRESHOLD
+        self.near_duplicate_filter = None
+        # Ids written for the current category, a repeated id is a repeated
+        # listing and would be a duplicate custom_id in the batch file
+        self.written_item_ids = set()
+        self.dropped_duplicates = 0
+        self.stream_offset = 0
+        self.resumed_dataset = None
         # relative path with reference to repo root
         self.dataset_storage_dir = "dataset/batch_files"
         self.preprocessed_dataset_storage_dir = "dataset/preprocessed_batch_files"
         self.batch_size = BATCH_SIZE
+        self.max_shard_bytes = MAX_SHARD_BYTES
+        self.shard_compression = SHARD_COMPRESSION
         self.max_datapoints_per_category = MAX_DATAPOINTS_PER_CATEGORY
         self.dataset_preprocessor = DatasetPreprocessor()
 
@@ -39,46 +87,216 @@ class DatasetHandler:
             path=self.hf_dataset_path,
             name=dataset_category,
             split="full",
-            streaming=True,
+            streaming=self.streaming,
         )
         dataset = dataset.remove_columns(["images", "videos"])
         return dataset
 
-    def write_to_file(self, filename: str, data: str) -> None:
-        if not data.endswith("\n"):
-            data += "\n"
-        with open(filename, "w") as f:
-            f.write(data)
+    def parse_dataset_per_category(
+        self,
+        dataset: Any,
+        dataset_category: str,
+        checkpoint_state: Dict[str, Any],
+    ) -> Iterable[Item]:
+        # Resume after the last committed shard of an interrupted run
+        self.stream_offset = checkpoint_state.get("stream_offset", 0)
+        if self.streaming:
+            if checkpoint_state.get("stream_state"):
+                dataset.load_state_dict(checkpoint_state["stream_state"])
+            elif self.stream_offset:
+                dataset = dataset.skip(self.stream_offset)
+            self.resumed_dataset = dataset
+            for datapoint in dataset:
+                self.stream_offset += 1
+                item = parse(datapoint=datapoint, category=dataset_category)
+                if item is not None:
+                    yield item
+            return
 
-    def save_dataset_per_category(self, dataset: Any, dataset_category: str) -> None:
-        count = 0
-        start = 0
-        data = ""
+        parsed_dataset = dataset.with_format("arrow").map(
+            parse_batch,
+            batched=True,
+            batch_size=PARSE_BATCH_SIZE,
+            num_proc=self.num_proc,
+            remove_columns=dataset.column_names,
+            fn_kwargs={"category": dataset_category},
+        )
+        parsed_dataset = parsed_dataset.with_format(None).skip(self.stream_offset)
+        for datapoint in parsed_dataset:
+            self.stream_offset += 1
+            yield Item(**datapoint)
+
+    def read_written_items(self, shards: List[Dict[str, Any]]) -> Iterable[Item]:
+        for shard in shards:
+            shard_path = f"{self.dataset_storage_dir}/{shard['name']}"
+            with open_shard(shard_path, "rt") as f:
+                for line in f:
+                    request = json.loads(line)
+                    yield Item(**json.loads(request["body"]["messages"][1]["content"]))
+
+    def make_near_duplicate_filter(self, items: List[Item]) -> NearDuplicateFilter:
+        near_duplicate_filter = NearDuplicateFilter(self.near_duplicate_threshold)
+        for item in items:
+            near_duplicate_filter.is_duplicate(self.deduplication_text(item))
+        return near_duplicate_filter
+
+    def deduplication_text(self, item: Item) -> str:
+        return f"{item.title}\n{item.description}"
+
+    def is_near_duplicate(self, item: Item) -> bool:
+        if item.item_id in self.written_item_ids:
+            self.dropped_duplicates += 1
+            return True
+        if self.near_duplicate_filter is None:
+            return False
+        if self.near_duplicate_filter.is_duplicate(self.deduplication_text(item)):
+            self.dropped_duplicates += 1
+            return True
+        return False
+
+    def make_checkpoint(self) -> Dict[str, Any]:
+        checkpoint_state = {
+            "stream_offset": self.stream_offset,
+            "dropped_duplicates": self.dropped_duplicates,
+        }
+        if self.streaming:
+            checkpoint_state["stream_state"] = self.resumed_dataset.state_dict()
+        return checkpoint_state
+
+    def save_dataset_per_category(
+        self, dataset: Any, dataset_category: str
+    ) -> Dict[str, Any]:
+        started_at = time.perf_counter()
         filename_prefix = f"{self.dataset_storage_dir}/{dataset_category}"
-        for datapoint in dataset:
-            item = parse(datapoint=datapoint, category=dataset_category)
-            if item is not None:
-                item = self.dataset_preprocessor.make_jsonl(item)
-                data += item + "\n"
+        with ShardWriter(
+            filename_prefix=filename_prefix,
+            max_rows=self.batch_size,
+            max_bytes=self.max_shard_bytes,
+            compression=self.shard_compression,
+            resume=self.should_resume,
+            checkpoint=self.make_checkpoint,
+        ) as shard_writer:
+            count = shard_writer.total_rows
+            if count:
+                logger.info(f"[{dataset_category}] Resuming after {count} items")
+            self.dropped_duplicates = shard_writer.checkpoint_state.get(
+                "dropped_duplicates", 0
+            )
+            # Items written before a resume must still count as seen
+            written_items = list(self.read_written_items(shard_writer.shards))
+            self.written_item_ids = {item.item_id for item in written_items}
+            self.near_duplicate_filter = None
+            if self.should_drop_near_duplicates:
+                self.near_duplicate_filter = self.make_near_duplicate_filter(
+                    written_items
+                )
+            items = self.parse_dataset_per_category(
+                dataset, dataset_category, shard_writer.checkpoint_state
+            )
+            for item in items:
+                if count >= self.max_datapoints_per_category:
+                    break
+                if self.is_near_duplicate(item):
+                    continue
+                shard_writer.write(self.dataset_preprocessor.make_batch_request_line(item))
+                self.written_item_ids.add(item.item_id)
                 count += 1
-                if count % self.batch_size == 0:
-                    filename = f"{filename_prefix}_{start}_{count-1}.jsonl"
-                    self.write_to_file(filename, data)
-                    data = ""
-                    start = count
-                if count > self.max_datapoints_per_category:
+                if count % PROGRESS_LOG_INTERVAL == 0:
+                    logger.info(f"[{dataset_category}] Parsed {count} items")
+                if count >= self.max_datapoints_per_category:
                     break
+            shard_writer.complete()
+        files = len(shard_writer.shards)
 
-        # Save any unwritten data (present in memory) to file
-        if data and count < self.max_datapoints_per_category:
-            filename = f"{filename_prefix}_{start}_{count-1}.jsonl"
-            self.write_to_file(filename, data)
-            data = ""
+        stats = {
+            "category": dataset_category,
+            "items": count,
+            "files": files,
+            "dropped_duplicates": self.dropped_duplicates,
+            "seconds": time.perf_counter() - started_at,
+        }
+        logger.info(
+            f"[{dataset_category}] Saved {stats['items']} items in {files} files, "
+            f"dropped {self.dropped_duplicates} near duplicates "
+            f"({stats['seconds']:.1f}s)"
+        )
+        return stats
+
+    def get_dataset_per_category(self, dataset_category: str) -> Dict[str, Any]:
+        filename_prefix = f"{self.dataset_storage_dir}/{dataset_category}"
+        manifest = read_manifest(filename_prefix) if self.should_resume else None
+        if manifest is not None and manifest.get("completed"):
+            logger.info(f"[{dataset_category}] Already downloaded, skipping")
+            return {
+                "category": dataset_category,
+                "items": manifest["total_rows"],
+                "files": len(manifest["shards"]),
+                "dropped_duplicates": manifest["checkpoint"].get(
+                    "dropped_duplicates", 0
+                ),
+                "seconds": 0.0,
+            }
+
+        dataset = self.download_dataset_per_category(dataset_category)
+        return self.save_dataset_per_category(dataset, dataset_category)
 
     def get_dataset(self) -> None:
+        if self.num_workers > 1:
+            self.get_dataset_parallel()
+            return
+
+        all_stats = []
         for dataset_category in self.dataset_categories:
-            dataset = self.download_dataset_per_category(dataset_category)
-            self.save_dataset_per_category(dataset, dataset_category)
+            stats = self.get_dataset_per_category(dataset_category)
+            all_stats.append(stats)
+        self.log_summary(all_stats)
+
+    def get_dataset_parallel(self) -> None:
+        # Each category is streamed, parsed and written by one of the pool's
+        # worker processes, which take the next category when done
+        max_workers = min(self.num_workers, len(self.dataset_categories))
+        logger.info(
+            f"Downloading {len(self.dataset_categories)} categories "
+            f"with {max_workers} workers"
+        )
+        all_stats = []
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as ppx:
+            futures = {
+                ppx.submit(
+                    download_category,
+                    self.hf_dataset_path,
+                    dataset_category,
+                    self.streaming,
+                    self.num_proc,
+                    self.should_resume,
+                ): dataset_category
+                for dataset_category in self.dataset_categories
+            }
+            for future in concurrent.futures.as_completed(futures):
+                dataset_category = futures[future]
+                try:
+                    stats = future.result()
+                except Exception as exc:
+                    logger.error(f"[{dataset_category}] Failed to download: {exc}")
+                    continue
+                all_stats.append(stats)
+                logger.info(
+                    f"Finished {len(all_stats)}/{len(futures)} categories "
+                    f"(latest: {dataset_category})"
+                )
+        self.log_summary(all_stats)
+
+    def log_summary(self, all_stats: List[Dict[str, Any]]) -> None:
+        total_items = sum(stats["items"] for stats in all_stats)
+        total_files = sum(stats["files"] for stats in all_stats)
+        total_dropped = sum(stats["dropped_duplicates"] for stats in all_stats)
+        msg = (
+            f"Downloaded {total_items} items in {total_files} files "
+            f"across {len(all_stats)} categories, "
+            f"dropped {total_dropped} near duplicates"
+        )
+        logger.info(msg)
+        print(msg)
 
     def preprocess(self) -> None:
         self.dataset_preprocessor.preprocess_batches(
@@ -87,6 +305,25 @@ class DatasetHandler:
         )
 
 
+def download_category(
+    hf_dataset_path: str,
+    dataset_category: str,
+    streaming: bool = SHOULD_STREAM_DATASET,
+    num_proc: int = NUM_PROC,
+    should_resume: bool = SHOULD_RESUME_DOWNLOAD,
+) -> Dict[str, Any]:
+    # Runs inside a worker process, so it builds its own handler and clients
+    dataset_handler = DatasetHandler(
+        hf_dataset_path=hf_dataset_path,
+        dataset_categories=[dataset_category],
+        num_workers=1,
+        streaming=streaming,
+        num_proc=num_proc,
+        should_resume=should_resume,
+    )
+    return dataset_handler.get_dataset_per_category(dataset_category)
+
+
 if __name__ == "__main__":
 
     login(token=HF_TOKEN, add_to_git_credential=True)
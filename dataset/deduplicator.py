@@ -0,0 +1,98 @@
+import re
+import zlib
+import numpy as np
+from collections import defaultdict
+from typing import List, Tuple
+
+SIMILARITY_THRESHOLD = 0.8
+NUM_PERMUTATIONS = 128
+SHINGLE_SIZE = 5
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def optimal_bands(threshold: float, num_permutations: int) -> Tuple[int, int]:
+    # LSH (bands, rows) whose similarity threshold (1 / bands) ** (1 / rows)
+    # is closest to the requested one
+    best, best_error = (1, num_permutations), float("inf")
+    for rows in range(1, num_permutations + 1):
+        bands = num_permutations // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+class NearDuplicateFilter:
+
+    def __init__(
+        self,
+        threshold: float = SIMILARITY_THRESHOLD,
+        num_permutations: int = NUM_PERMUTATIONS,
+        shingle_size: int = SHINGLE_SIZE,
+        seed: int = 1,
+    ) -> None:
+        self.threshold = threshold
+        self.num_permutations = num_permutations
+        self.shingle_size = shingle_size
+        self.bands, self.rows = optimal_bands(threshold, num_permutations)
+
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(
+            1, MERSENNE_PRIME, size=(num_permutations, 1), dtype=np.uint64
+        )
+        self.b = rng.randint(
+            0, MERSENNE_PRIME, size=(num_permutations, 1), dtype=np.uint64
+        )
+        # Candidates are only looked up in LSH buckets, so no pairwise
+        # comparison over all items is ever done
+        self.buckets: List[defaultdict] = [
+            defaultdict(list) for _ in range(self.bands)
+        ]
+        self.signatures: List[np.ndarray] = []
+
+    def shingles(self, text: str) -> List[bytes]:
+        words = WORD_PATTERN.findall(text.lower())
+        if len(words) <= self.shingle_size:
+            return [" ".join(words).encode("utf-8")]
+        return [
+            " ".join(words[i : i + self.shingle_size]).encode("utf-8")
+            for i in range(len(words) - self.shingle_size + 1)
+        ]
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.array(
+            [zlib.crc32(shingle) for shingle in set(self.shingles(text))],
+            dtype=np.uint64,
+        )
+        permuted = (self.a * hashes + self.b) % MERSENNE_PRIME
+        permuted = np.bitwise_and(permuted, MAX_HASH)
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [
+            signature[band * self.rows : (band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
+
+    def is_duplicate(self, text: str) -> bool:
+        # Returns True for a near duplicate of an earlier text, otherwise
+        # remembers the text and returns False
+        signature = self.signature(text)
+        band_keys = self.band_keys(signature)
+        checked = set()
+        for bucket, band_key in zip(self.buckets, band_keys):
+            for index in bucket.get(band_key, []):
+                if index in checked:
+                    continue
+                checked.add(index)
+                similarity = np.mean(self.signatures[index] == signature)
+                if similarity >= self.threshold:
+                    return True
+
+        index = len(self.signatures)
+        self.signatures.append(signature)
+        for bucket, band_key in zip(self.buckets, band_keys):
+            bucket[band_key].append(index)
+        return False
@@ -0,0 +1,122 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Tuple
+from dataset.parser import is_legacy_item_id, make_item_id
+from dataset.shards import (
+    PARTIAL_SUFFIX,
+    list_shards,
+    open_compressed,
+    open_shard,
+    shard_compression,
+)
+from common.loggers import dataset_logger as logger
+
+# legacy custom_id -> content derived id, kept next to the raw batch files
+# until every file is migrated
+ID_MAPPING_FILE = "item_id_mapping.json"
+
+
+class ItemIdMigrator:
+    # Migrated files are written next to the originals and moved in place
+    # only after both passes succeeded. The id mapping is saved before that,
+    # so a run interrupted while moving files is completed by the next one,
+    # processed lines still on legacy ids are mapped with the saved mapping.
+
+    def __init__(self, raw_dataset_dir: str, processed_dataset_dir: str) -> None:
+        self.raw_dataset_dir = Path(raw_dataset_dir)
+        self.processed_dataset_dir = Path(processed_dataset_dir)
+        # legacy custom_id -> content derived id
+        self.id_mapping: Dict[str, str] = {}
+        # content derived id -> legacy custom_id it was assigned to
+        self.assigned_ids: Dict[str, str] = {}
+        self.id_mapping_path = self.raw_dataset_dir / ID_MAPPING_FILE
+        self.rewritten_files: List[Tuple[Path, Path]] = []
+
+    def migrate_raw_line(self, line: str) -> str:
+        data = json.loads(line)
+        custom_id = data["custom_id"]
+        if not is_legacy_item_id(custom_id):
+            return line
+
+        message = data["body"]["messages"][1]
+        product_data = json.loads(message["content"])
+        item_id = make_item_id(
+            product_data["category"],
+            product_data["title"],
+            product_data["description"],
+            product_data["price"],
+        )
+        if self.assigned_ids.get(item_id, custom_id) != custom_id:
+            # Legacy items with identical content, the legacy id keeps them apart
+            item_id = make_item_id(
+                product_data["category"],
+                product_data["title"],
+                product_data["description"],
+                product_data["price"],
+                discriminator=custom_id,
+            )
+        self.assigned_ids[item_id] = custom_id
+        if custom_id in self.id_mapping and self.id_mapping[custom_id] != item_id:
+            logger.warning(f"Legacy id {custom_id} is used by more than one item")
+        self.id_mapping[custom_id] = item_id
+        product_data["item_id"] = item_id
+        message["content"] = json.dumps(product_data)
+        data["custom_id"] = item_id
+        return json.dumps(data)
+
+    def migrate_processed_line(self, line: str) -> str:
+        data = json.loads(line)
+        custom_id = data["custom_id"]
+        if custom_id not in self.id_mapping:
+            return line
+        data["custom_id"] = self.id_mapping[custom_id]
+        return json.dumps(data)
+
+    def rewrite_file(self, file_path: Path, migrate_line) -> None:
+        with open_shard(file_path, "rt") as f:
+            lines = [migrate_line(line.strip()) for line in f if line.strip()]
+        partial_file_path = Path(f"{file_path}{PARTIAL_SUFFIX}")
+        with open_compressed(
+            partial_file_path, "wt", shard_compression(file_path)
+        ) as f:
+            f.write("\n".join(lines) + "\n")
+        self.rewritten_files.append((partial_file_path, file_path))
+
+    def load_id_mapping(self) -> None:
+        if self.id_mapping_path.exists():
+            with open(self.id_mapping_path, "r") as f:
+                self.id_mapping = json.load(f)
+            self.assigned_ids = {
+                item_id: custom_id for custom_id, item_id in self.id_mapping.items()
+            }
+
+    def save_id_mapping(self) -> None:
+        partial_id_mapping_path = Path(f"{self.id_mapping_path}{PARTIAL_SUFFIX}")
+        with open(partial_id_mapping_path, "w") as f:
+            json.dump(self.id_mapping, f)
+        os.replace(partial_id_mapping_path, self.id_mapping_path)
+
+    def migrate(self) -> None:
+        self.load_id_mapping()
+        # Raw files first, they hold the item content the new ids are derived from
+        for file_path in list_shards(self.raw_dataset_dir):
+            self.rewrite_file(file_path, self.migrate_raw_line)
+        for file_path in list_shards(self.processed_dataset_dir):
+            self.rewrite_file(file_path, self.migrate_processed_line)
+
+        self.save_id_mapping()
+        for partial_file_path, file_path in self.rewritten_files:
+            os.replace(partial_file_path, file_path)
+        self.id_mapping_path.unlink()
+        logger.info(f"Migrated {len(self.id_mapping)} legacy item ids")
+        print(f"Migrated {len(self.id_mapping)} legacy item ids")
+
+
+if __name__ == "__main__":
+    # relative path wrt repo root
+    item_id_migrator = ItemIdMigrator(
+        raw_dataset_dir="dataset/batch_files",
+        processed_dataset_dir="dataset/preprocessed_batch_files",
+    )
+    item_id_migrator.migrate()
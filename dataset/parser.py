@@ -1,55 +1,159 @@
 from models.item import Item
-from typing import Optional
+from typing import Any, Optional
+import hashlib
 import re
 import json
+import pyarrow as pa
+import pyarrow.compute as pc
 
 MIN_PRICE = 0.5
 MAX_PRICE = 1000.0
 MIN_CHARS = 500
 MAX_CHARS = 5000
-item_idx = 0
+ITEM_ID_DIGEST_LENGTH = 16
+
+# Patterns are compiled once and shared by the per-row and batched parsers
+PRICE_PATTERN = re.compile(r"^\d+(\.\d+)?$")
+REPLACEMENT_PATTERN = re.compile(r"[\[\]:'\"\{\};\/\\\(\)\*]+")
+MULTIPLE_WHITESPACES_PATTERN = re.compile(r" {2,}")
+NON_ASCII_PATTERN = r"[^\x00-\x7F]+"
+# Characters removed by str.strip()
+STRIP_CHARACTERS = " \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f"
 
 
 def scrub(contents: str) -> str:
-    replacement_regex = r"[\[\]:'\"\{\};\/\\\(\)\*]+"
-    multiple_whitespaces_regex = r" {2,}"
-    contents = re.sub(replacement_regex, " ", contents)
-    contents = re.sub(multiple_whitespaces_regex, " ", contents)
+    contents = REPLACEMENT_PATTERN.sub(" ", contents)
+    contents = MULTIPLE_WHITESPACES_PATTERN.sub(" ", contents)
     contents = contents.encode("ascii", "ignore").decode()
     contents = contents.strip()
     return contents
 
 
+def format_details(details: str) -> str:
+    # exclude product or item numbers
+    return "\n".join(
+        f"{key}: {value}"
+        for key, value in json.loads(details).items()
+        if not key.lower().strip().endswith("number")
+    )
+
+
+def make_item_id(
+    category: str,
+    title: str,
+    description: str,
+    price: float,
+    discriminator: Optional[str] = None,
+) -> str:
+    # Derived from the item (not from a counter), so every worker computes the
+    # same id. The discriminator (parent_asin of the listing) tells apart
+    # listings with identical content, which would otherwise share a custom_id
+    # within a batch file.
+    fields = [category, title, description, str(float(price))]
+    if discriminator:
+        fields.append(discriminator)
+    key = "\n".join(fields)
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return f"{category}-{digest[:ITEM_ID_DIGEST_LENGTH]}"
+
+
+def is_legacy_item_id(item_id: str) -> bool:
+    # Items parsed before content derived ids used a global counter
+    return str(item_id).isdigit()
+
+
 def parse(datapoint: dict, category: str) -> Optional[Item]:
-    global item_idx
     title = datapoint["title"]
     price = datapoint["price"]
     category = category.replace("raw_meta_", "")
-    price_pattern = r"^\d+(\.\d+)?$"
-    if not re.match(price_pattern, price):
+    if not PRICE_PATTERN.match(price):
         return
 
     if price.lower() != "none" and (MIN_PRICE <= float(price) <= MAX_PRICE):
         contents = ""
         contents += "\n".join(datapoint["features"]) + "\n"
         contents += "\n".join(datapoint["description"]) + "\n"
-        details = [
-            f"{key}: {value}"
-            for key, value in json.loads(datapoint["details"]).items()
-            if not key.lower()
-            .strip()
-            .endswith("number")  # exclude product or item numbers
-        ]
-        contents += "\n".join(details)
+        contents += format_details(datapoint["details"])
         contents = scrub(contents)
 
         if MIN_CHARS <= len(contents):
+            description = contents[:MAX_CHARS]
             item = Item(
-                item_id=item_idx,
+                item_id=make_item_id(
+                    category, title, description, price, datapoint.get("parent_asin")
+                ),
                 title=title,
                 category=category,
-                description=contents[:MAX_CHARS],
+                description=description,
                 price=price,
             )
-            item_idx += 1
             return item
+
+
+def scrub_batch(contents: pa.Array) -> pa.Array:
+    contents = pc.replace_substring_regex(contents, REPLACEMENT_PATTERN.pattern, " ")
+    contents = pc.replace_substring_regex(
+        contents, MULTIPLE_WHITESPACES_PATTERN.pattern, " "
+    )
+    contents = pc.replace_substring_regex(contents, NON_ASCII_PATTERN, "")
+    contents = pc.utf8_trim(contents, characters=STRIP_CHARACTERS)
+    return contents
+
+
+def parse_batch(batch: Any, category: str) -> pa.Table:
+    # Batched equivalent of parse(), meant for
+    # dataset.with_format("arrow").map(parse_batch, batched=True, num_proc=N)
+    if isinstance(batch, dict):
+        batch = pa.Table.from_pydict(batch)
+    category = category.replace("raw_meta_", "")
+
+    # Price filter on the whole column
+    price = batch.column("price")
+    is_numeric = pc.fill_null(
+        pc.match_substring_regex(price, PRICE_PATTERN.pattern), False
+    )
+    numeric_price = pc.cast(pc.if_else(is_numeric, price, "0"), pa.float64())
+    in_range = pc.and_(
+        pc.greater_equal(numeric_price, MIN_PRICE),
+        pc.less_equal(numeric_price, MAX_PRICE),
+    )
+    price_mask = pc.and_(is_numeric, in_range)
+    batch = batch.filter(price_mask)
+    numeric_price = pc.filter(numeric_price, price_mask)
+
+    # Build and scrub contents for the remaining rows
+    features = pc.fill_null(pc.binary_join(batch.column("features"), "\n"), "")
+    description = pc.fill_null(pc.binary_join(batch.column("description"), "\n"), "")
+    details = pa.array(
+        [format_details(d) for d in batch.column("details").to_pylist()],
+        type=pa.string(),
+    )
+    contents = pc.binary_join_element_wise(features, description, details, "\n")
+    contents = scrub_batch(contents)
+
+    # Length filter on the whole column
+    length_mask = pc.greater_equal(pc.utf8_length(contents), MIN_CHARS)
+    titles = pc.filter(batch.column("title"), length_mask).to_pylist()
+    parent_asins = [None] * len(titles)
+    if "parent_asin" in batch.column_names:
+        parent_asins = pc.filter(batch.column("parent_asin"), length_mask).to_pylist()
+    prices = pc.filter(numeric_price, length_mask).to_pylist()
+    descriptions = pc.utf8_slice_codeunits(
+        pc.filter(contents, length_mask), 0, MAX_CHARS
+    ).to_pylist()
+
+    item_ids = [
+        make_item_id(category, title, description, price, parent_asin)
+        for title, description, price, parent_asin in zip(
+            titles, descriptions, prices, parent_asins
+        )
+    ]
+    return pa.table(
+        {
+            "item_id": pa.array(item_ids, type=pa.string()),
+            "title": pa.array(titles, type=pa.string()),
+            "category": pa.array([category] * len(item_ids), type=pa.string()),
+            "description": pa.array(descriptions, type=pa.string()),
+            "price": pa.array(prices, type=pa.float64()),
+        }
+    )
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from typing import Dict, Iterable, Optional
+
+SQLITE_MAX_VARIABLES = 900
+
+
+class PreprocessingCache:
+
+    def __init__(self, cache_path: str) -> None:
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, content TEXT)"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(model: str, system_prompt: str, item_payload: str) -> str:
+        # Item payload is canonicalised so that formatting changes keep hits
+        payload = json.dumps(
+            json.loads(item_payload), sort_keys=True, separators=(",", ":")
+        )
+        key = "\0".join([model, system_prompt, payload])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def make_request_key(cls, request: dict) -> str:
+        # Key for a batch request line created by DatasetPreprocessor.make_batch_request_line
+        body = request["body"]
+        system_prompt = body["messages"][0]["content"]
+        item_payload = body["messages"][1]["content"]
+        return cls.make_key(body["model"], system_prompt, item_payload)
+
+    def get(self, key: str) -> Optional[str]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        keys = list(keys)
+        results = {}
+        with self.lock:
+            for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                chunk = keys[start : start + SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT key, content FROM results WHERE key IN ({placeholders})",
+                    chunk,
+                )
+                results.update(rows)
+        return results
+
+    def put_many(self, results: Dict[str, str]) -> None:
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO results (key, content) VALUES (?, ?)",
+                results.items(),
+            )
+            self.connection.commit()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+def make_result_line(custom_id: str, content: str) -> str:
+    # Same shape as a Batch API output line, as read by HFDatasetUploader
+    line = {
+        "id": None,
+        "custom_id": custom_id,
+        "response": {
+            "status_code": 200,
+            "request_id": None,
+            "body": {
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+            },
+        },
+        "error": None,
+    }
+    return json.dumps(line)
+
+
+def read_result_content(result: dict) -> Optional[str]:
+    response = result.get("response")
+    if result.get("error") is not None or not response:
+        return None
+    if response.get("status_code") != 200:
+        return None
+    return response["body"]["choices"][0]["message"]["content"]
+
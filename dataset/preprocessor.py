@@ -1,20 +1,41 @@
 import concurrent.futures
+import functools
 import json
-import time
+from collections import defaultdict
 from models.item import Item
+from models.codec import encode_batch_request
 from common.constants import (
     OPENAI_API_KEY,
     LOCAL_OLLAMA_BASE_URL,
+    LOCAL_OLLAMA_API_KEY,
     LOCAL_OLLAMA_MODEL,
 )
 from common.loggers import dataset_logger as logger
-from typing import Tuple, List
+from dataset.batch_packer import BatchPacker
+from dataset.batch_scheduler import BatchScheduler
+from dataset.preprocessing_cache import (
+    PreprocessingCache,
+    make_result_line,
+    read_result_content,
+)
+from dataset.shards import list_shards, open_shard, shard_output_name
+from typing import Dict, Iterator, List, Tuple
 from openai import OpenAI
 from pathlib import Path
 
 SHOULD_USE_LOCAL_OLLAMA_MODEL = False
+# Local servers do not support the Batch API, so requests are sent directly
+# as chat completions with REALTIME_CONCURRENCY requests in flight
+SHOULD_USE_REALTIME_PREPROCESSING = SHOULD_USE_LOCAL_OLLAMA_MODEL
+REALTIME_CONCURRENCY = 8
 PREPROCESSING_MODEL = "gpt-4.1-nano"
-BATCH_LIMIT = 2
+PREPROCESSING_MAX_TOKENS = 1000
+BATCH_LIMIT = 10
+MAX_TOKENS_PER_BATCH_FILE = 500_000
+MAX_ENQUEUED_TOKENS = 2_000_000
+# Results are cached by (model, system prompt, item) so unchanged items
+# are never sent for preprocessing again
+PREPROCESSING_CACHE_PATH = "dataset/preprocessing_cache.sqlite3"
 TEXT_PREPROCESSING_SYSTEM_PROMPT = """
 Create a concise description of a product based on the provided details. Respond in the following format
 Title: title of the product (for example, Microwave oven)
@@ -29,132 +50,217 @@ class DatasetPreprocessor:
 
     def __init__(self) -> None:
         if SHOULD_USE_LOCAL_OLLAMA_MODEL:
-            self.openai_client = OpenAI(base_url=LOCAL_OLLAMA_BASE_URL)
+            self.openai_client = OpenAI(
+                base_url=LOCAL_OLLAMA_BASE_URL, api_key=LOCAL_OLLAMA_API_KEY
+            )
             self.model = LOCAL_OLLAMA_MODEL
         else:
             self.openai_client = OpenAI(api_key=OPENAI_API_KEY)
             self.model = PREPROCESSING_MODEL
 
         self.batch_limit = BATCH_LIMIT
-        self.file_ids = {}
-        self.batch_ids = []
-        self.results = []
-
-    def make_jsonl(self, item: Item) -> str:
-        body = {
-            "model": self.model,
-            "messages": [
-                {"role": "system", "content": TEXT_PREPROCESSING_SYSTEM_PROMPT},
-                {"role": "user", "content": item.to_json()},
-            ],
-            "max_tokens": 1000,
-        }
-        line = {
-            "custom_id": str(item.item_id),
-            "method": "POST",
-            "url": "/v1/chat/completions",
-            "body": body,
-        }
-        return json.dumps(line)
-
-    def retrieve_batch(self, batch_id: str) -> Tuple[str, str]:
-        try:
-            result = self.openai_client.batches.retrieve(batch_id=batch_id)
-            while result.status != "completed":
-                if result.status == "failed":
-                    logger.info(f"Errors = {result.errors}")
-                    return None, None
-
-                time.sleep(5)
-                result = self.openai_client.batches.retrieve(batch_id=batch_id)
-            batch_input_file_id = result.input_file_id
-            batch_output_file_id = result.output_file_id
-            return (batch_input_file_id, batch_output_file_id)
-        except Exception as exc:
-            logger.info(f"Failed to process batch {batch_id}, error: {exc}")
-            return None, None
-
-    def submit_files(self, file_paths: List[Path]) -> None:
-        for file_path in file_paths:
-            with open(file_path, "rb") as f:
-                response = self.openai_client.files.create(file=f, purpose="batch")
-                file_id = response.id
-                self.file_ids[file_id] = file_path.name
-        total_batch_files = len(list(self.file_ids.keys()))
-        logger.info(f"Uploaded {total_batch_files} batch files for preprocessing")
-
-    def create_batches(self) -> None:
-        for file_id in self.file_ids.keys():
-            response = self.openai_client.batches.create(
-                completion_window="24h",
-                endpoint="/v1/chat/completions",
-                input_file_id=file_id,
-            )
-            batch_id = response.id
-            self.batch_ids.append(batch_id)
+        self.should_use_realtime = SHOULD_USE_REALTIME_PREPROCESSING
+        self.realtime_concurrency = REALTIME_CONCURRENCY
+        self.cache = PreprocessingCache(PREPROCESSING_CACHE_PATH)
+        # Requests are packed into batch files by estimated prompt tokens
+        # and limited in flight due to enqueued token limits
+        self.batch_packer = BatchPacker(max_tokens=MAX_TOKENS_PER_BATCH_FILE)
+        self.batch_scheduler = BatchScheduler(
+            openai_client=self.openai_client,
+            max_in_flight=self.batch_limit,
+            max_in_flight_tokens=MAX_ENQUEUED_TOKENS,
+        )
+        # custom_id -> (cache key, output file name) of submitted requests
+        self.pending: Dict[str, Tuple[str, str]] = {}
 
-        logger.info(f"Created {len(self.batch_ids)} batches for preprocessing")
+    def make_batch_request_line(self, item: Item) -> str:
+        return encode_batch_request(
+            model=self.model,
+            system_prompt=TEXT_PREPROCESSING_SYSTEM_PROMPT,
+            item=item,
+            max_tokens=PREPROCESSING_MAX_TOKENS,
+        )
 
-    def retrieve_batches(self) -> None:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as tpx:
-            self.results = tpx.map(self.retrieve_batch, self.batch_ids)
-        logger.info(f"Preprocessed {len(self.batch_ids)} batches and retrieved results")
+    def prepare_requests(
+        self, file_path: Path, output_batch_files_dir: str
+    ) -> List[Tuple[str, dict]]:
+        # Writes cached results straight to the output file and returns
+        # the remaining (line, request) pairs to be submitted
+        file_name = shard_output_name(file_path)
+        with open_shard(file_path, "rt") as f:
+            lines = [line.strip() for line in f if line.strip()]
 
-    def store_batch_file_results(self, output_batch_files_dir: str) -> None:
-        logger.info("Proceeding to save preprocessing results in local storage")
-        logger.info(f"Results output dir: {output_batch_files_dir}")
-        for input_file_id, output_file_id in self.results:
-            if input_file_id is None and output_file_id is None:
+        requests = {}
+        for line in lines:
+            request = json.loads(line)
+            key = PreprocessingCache.make_request_key(request)
+            requests[request["custom_id"]] = (key, line, request)
+        cached = self.cache.get_many(key for key, _, _ in requests.values())
+
+        output_file_path = Path(output_batch_files_dir) / file_name
+        misses = []
+        with open(output_file_path, "w") as f:
+            for custom_id, (key, line, request) in requests.items():
+                if key in cached:
+                    f.write(make_result_line(custom_id, cached[key]) + "\n")
+                else:
+                    self.pending[custom_id] = (key, file_name)
+                    misses.append((line, request))
+
+        logger.info(
+            f"{file_name}: {len(requests) - len(misses)} cached, "
+            f"{len(misses)} to preprocess"
+        )
+        return misses
+
+    def iter_pending_requests(
+        self, input_batch_files_dir: Path, output_batch_files_dir: str
+    ) -> Iterator[Tuple[str, dict]]:
+        for file_path in list_shards(input_batch_files_dir):
+            yield from self.prepare_requests(file_path, output_batch_files_dir)
+
+    def store_result_lines(self, output_batch_files_dir: str, lines: List[str]) -> int:
+        # Results may mix requests from several input files, they are
+        # appended to the output file of the input file they came from
+        # Failed requests are left out, so they are retried on the next run
+        output_lines = defaultdict(list)
+        results = {}
+        for line in lines:
+            result = json.loads(line)
+            pending = self.pending.pop(result["custom_id"], None)
+            if pending is None:
+                # Not submitted by this run or already stored
+                logger.info(f"Skipping result of unknown request {result['custom_id']}")
                 continue
-            response = self.openai_client.files.content(file_id=output_file_id)
-            output_file_name = self.file_ids[input_file_id]
+            key, output_file_name = pending
+            result_content = read_result_content(result)
+            if result_content is None:
+                logger.info(f"Failed to preprocess {result['custom_id']}")
+                continue
+            output_lines[output_file_name].append(line)
+            results[key] = result_content
+
+        for output_file_name, file_lines in output_lines.items():
             output_file_path = Path(output_batch_files_dir) / output_file_name
-            response.write_to_file(file=output_file_path)
+            with open(output_file_path, "a") as f:
+                f.write("\n".join(file_lines) + "\n")
+        self.cache.put_many(results)
+        return len(results)
 
-    def preprocess_limited_batches(
+    def store_batch_file_result(
+        self, output_batch_files_dir: str, file_name: str, content: bytes
+    ) -> None:
+        lines = [line for line in content.decode("utf-8").splitlines() if line.strip()]
+        total_results = self.store_result_lines(output_batch_files_dir, lines)
+        logger.info(f"Cached {total_results} preprocessing results from {file_name}")
+
+    def complete_request(self, request: dict) -> str:
+        try:
+            response = self.openai_client.chat.completions.create(**request["body"])
+            result = {
+                "id": None,
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "request_id": None,
+                    "body": response.model_dump(),
+                },
+                "error": None,
+            }
+        except Exception as exc:
+            result = {
+                "id": None,
+                "custom_id": request["custom_id"],
+                "response": None,
+                "error": {"message": str(exc)},
+            }
+        return json.dumps(result)
+
+    def preprocess_realtime(
         self,
+        input_batch_files_dir: Path,
         output_batch_files_dir: str,
-        file_paths: List[Path],
-    ) -> bool:
-        # Batch processing with 4 steps
-        # 1. Create files
-        # 2. Create batches for each file
-        # 3. Retrieve processed batches
-        # 4. Get processed file content for each batch/input file
-
-        # Step 1: Create files
-        self.submit_files(file_paths=file_paths)
+    ) -> None:
+        # Keeps realtime_concurrency requests in flight, results are written
+        # in the Batch API output format as they complete
+        requests = self.iter_pending_requests(
+            input_batch_files_dir, output_batch_files_dir
+        )
+        next_request = next(requests, None)
+        pending = set()
+        total_results = 0
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.realtime_concurrency
+        ) as tpx:
+            while next_request is not None or pending:
+                while next_request is not None and (
+                    len(pending) < 2 * self.realtime_concurrency
+                ):
+                    _, request = next_request
+                    pending.add(tpx.submit(self.complete_request, request))
+                    next_request = next(requests, None)
 
-        # Step 2: Create batches
-        self.create_batches()
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                lines = [future.result() for future in done]
+                total_results += self.store_result_lines(output_batch_files_dir, lines)
+        logger.info(f"Preprocessed {total_results} items in realtime mode")
 
-        # Step 3: Retrieve processed batches
-        self.retrieve_batches()
+    def seed_cache(
+        self, input_batch_files_dir: Path, output_batch_files_dir: str
+    ) -> None:
+        # Results already present in the output dir (e.g. from runs before
+        # the cache existed) are added to the cache by joining on custom_id
+        existing_results = {}
+        for file_path in list_shards(output_batch_files_dir):
+            with open_shard(file_path, "rt") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    result = json.loads(line)
+                    content = read_result_content(result)
+                    if content is not None:
+                        existing_results[result["custom_id"]] = content
+        if not existing_results:
+            return
 
-        # Step 4: Get processed file content for each batch/input file
-        self.store_batch_file_results(output_batch_files_dir=output_batch_files_dir)
+        results = {}
+        for file_path in list_shards(input_batch_files_dir):
+            with open_shard(file_path, "rt") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    request = json.loads(line)
+                    content = existing_results.get(request["custom_id"])
+                    if content is not None:
+                        key = PreprocessingCache.make_request_key(request)
+                        results[key] = content
+        self.cache.put_many(results)
+        logger.info(f"Seeded preprocessing cache with {len(results)} results")
 
     def preprocess_batches(
         self,
         input_batch_files_dir: str,
         output_batch_files_dir: str,
     ) -> None:
-        # Process limited batches due to token limits on smaller models
         input_batch_files_dir = Path(input_batch_files_dir)
         logger.info(
             f"Proceeding to preprocess batch files (dir: {input_batch_files_dir})"
         )
-        file_paths = []
-
-        for file_path in input_batch_files_dir.glob("*.jsonl"):
-            file_paths.append(file_path)
-            if len(file_paths) >= self.batch_limit:
-                self.preprocess_limited_batches(
-                    output_batch_files_dir=output_batch_files_dir,
-                    file_paths=file_paths,
-                )
-                # Reset values as new batch will be formed
-                file_paths = []
-                self.file_ids = {}
-                self.batch_ids = []
-                self.results = []
+        logger.info(f"Results output dir: {output_batch_files_dir}")
+        self.seed_cache(input_batch_files_dir, output_batch_files_dir)
+
+        if self.should_use_realtime:
+            self.preprocess_realtime(input_batch_files_dir, output_batch_files_dir)
+            return
+
+        requests = self.iter_pending_requests(
+            input_batch_files_dir, output_batch_files_dir
+        )
+        self.batch_scheduler.run(
+            batch_files=self.batch_packer.pack(requests),
+            on_result=functools.partial(
+                self.store_batch_file_result, output_batch_files_dir
+            ),
+        )
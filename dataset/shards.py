@@ -0,0 +1,263 @@
+import gzip
+import hashlib
+import json
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+import zstandard
+from pathlib import Path
+from typing import IO, Any, Callable, Dict, List, Optional
+
+SHARD_SUFFIXES = {
+    None: ".jsonl",
+    "gzip": ".jsonl.gz",
+    "zstd": ".jsonl.zst",
+}
+MANIFEST_SUFFIX = ".manifest.json"
+PARTIAL_SUFFIX = ".partial"
+
+
+def shard_compression(path: str | Path) -> Optional[str]:
+    name = str(path)
+    for compression, suffix in SHARD_SUFFIXES.items():
+        if compression is not None and name.endswith(suffix):
+            return compression
+    return None
+
+
+def open_compressed(
+    path: str | Path, mode: str = "rt", compression: Optional[str] = None
+) -> IO:
+    encoding = None if "b" in mode else "utf-8"
+    if compression == "gzip":
+        return gzip.open(path, mode, encoding=encoding)
+    if compression == "zstd":
+        return zstandard.open(path, mode, encoding=encoding)
+    return open(path, mode, encoding=encoding)
+
+
+def open_shard(path: str | Path, mode: str = "rt") -> IO:
+    # Opens plain and compressed shards alike, based on the file suffix
+    return open_compressed(path, mode, shard_compression(path))
+
+
+def list_shards(directory: str | Path) -> List[Path]:
+    directory = Path(directory)
+    shards = []
+    for suffix in SHARD_SUFFIXES.values():
+        shards.extend(directory.glob(f"*{suffix}"))
+    return sorted(shards)
+
+
+def shard_output_name(path: str | Path) -> str:
+    # Plain jsonl name of the shard's output file, compressed shards keep
+    # their compression in it so that "x_0_249.jsonl" and "x_0_249.jsonl.gz"
+    # do not share an output file, e.g. "x_0_249.gzip.jsonl"
+    name = Path(path).name
+    compression = shard_compression(name)
+    if compression is None:
+        return name
+    stem = name[: -len(SHARD_SUFFIXES[compression])]
+    return f"{stem}.{compression}{SHARD_SUFFIXES[None]}"
+
+
+def read_manifest(filename_prefix: str) -> Optional[Dict[str, Any]]:
+    manifest_path = Path(f"{filename_prefix}{MANIFEST_SUFFIX}")
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+class ShardWriter:
+
+    def __init__(
+        self,
+        filename_prefix: str,
+        max_rows: int,
+        max_bytes: Optional[int] = None,
+        compression: Optional[str] = None,
+        resume: bool = False,
+        checkpoint: Optional[Callable[[], Dict[str, Any]]] = None,
+    ) -> None:
+        if compression not in SHARD_SUFFIXES:
+            raise ValueError(f"Unsupported shard compression: {compression}")
+        self.filename_prefix = filename_prefix
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.suffix = SHARD_SUFFIXES[compression]
+        self.manifest_path = Path(f"{filename_prefix}{MANIFEST_SUFFIX}")
+        self.shards: List[Dict[str, Any]] = []
+        self.total_rows = 0
+        self.file = None
+        self.partial_path = None
+        self.shard_start = 0
+        self.shard_rows = 0
+        self.shard_bytes = 0
+        self.shard_hash = None
+        # Called whenever a shard is committed, its result is stored in the
+        # manifest so that an interrupted run can resume after that shard
+        self.checkpoint = checkpoint
+        self.checkpoint_state: Dict[str, Any] = {}
+        self.completed = False
+
+        manifest = read_manifest(filename_prefix) if resume else None
+        if manifest is not None:
+            self.shards = manifest["shards"]
+            self.total_rows = manifest["total_rows"]
+            self.checkpoint_state = manifest.get("checkpoint", {})
+            self.completed = manifest.get("completed", False)
+        self.remove_partial_shards()
+
+    def __enter__(self) -> "ShardWriter":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        if exc_type is not None:
+            # Uncommitted rows are written again when the run is resumed
+            self.abort()
+        else:
+            self.close()
+
+    def remove_partial_shards(self) -> None:
+        prefix = Path(self.filename_prefix)
+        for partial_path in prefix.parent.glob(f"{prefix.name}_*{PARTIAL_SUFFIX}"):
+            partial_path.unlink()
+
+    def open_shard(self) -> None:
+        self.shard_start = self.total_rows
+        self.shard_rows = 0
+        self.shard_bytes = 0
+        self.shard_hash = hashlib.sha256()
+        self.partial_path = Path(
+            f"{self.filename_prefix}_{self.shard_start}{self.suffix}{PARTIAL_SUFFIX}"
+        )
+        self.file = open_compressed(self.partial_path, "wb", self.compression)
+
+    def write(self, line: str) -> None:
+        if self.file is None:
+            self.open_shard()
+        data = (line + "\n").encode("utf-8")
+        self.file.write(data)
+        self.shard_hash.update(data)
+        self.shard_rows += 1
+        self.shard_bytes += len(data)
+        self.total_rows += 1
+
+        if self.shard_rows >= self.max_rows or (
+            self.max_bytes is not None and self.shard_bytes >= self.max_bytes
+        ):
+            self.close_shard()
+
+    def close_shard(self) -> None:
+        self.file.close()
+        self.file = None
+        shard_end = self.shard_start + self.shard_rows - 1
+        shard_path = Path(
+            f"{self.filename_prefix}_{self.shard_start}_{shard_end}{self.suffix}"
+        )
+        os.replace(self.partial_path, shard_path)
+        self.shards.append(
+            {
+                "name": shard_path.name,
+                "rows": self.shard_rows,
+                "bytes": self.shard_bytes,
+                # checksum of the uncompressed shard content
+                "sha256": self.shard_hash.hexdigest(),
+            }
+        )
+        if self.checkpoint is not None:
+            self.checkpoint_state = self.checkpoint()
+        self.write_manifest()
+
+    def write_manifest(self) -> None:
+        manifest = {
+            "compression": self.compression,
+            "total_rows": sum(shard["rows"] for shard in self.shards),
+            "completed": self.completed,
+            "checkpoint": self.checkpoint_state,
+            "shards": self.shards,
+        }
+        partial_manifest_path = Path(f"{self.manifest_path}{PARTIAL_SUFFIX}")
+        with open(partial_manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(partial_manifest_path, self.manifest_path)
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.close_shard()
+
+    def complete(self) -> None:
+        self.close()
+        self.completed = True
+        self.write_manifest()
+
+    def abort(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.total_rows -= self.shard_rows
+            self.partial_path.unlink()
+
+
+class ParquetShardWriter:
+
+    def __init__(
+        self,
+        output_dir: str | Path,
+        split: str,
+        schema: pa.Schema,
+        max_rows: int,
+        row_group_size: int,
+    ) -> None:
+        self.output_dir = Path(output_dir)
+        self.split = split
+        self.schema = schema
+        self.max_rows = max_rows
+        self.row_group_size = row_group_size
+        self.writer = None
+        self.rows: List[Dict[str, Any]] = []
+        self.shard_index = 0
+        self.shard_rows = 0
+        self.total_rows = 0
+
+    def __enter__(self) -> "ParquetShardWriter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def write(self, row: Dict[str, Any]) -> None:
+        self.rows.append(row)
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        # Writes buffered rows as one row group, shards rotate after max_rows
+        if not self.rows:
+            return
+        if self.writer is None:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            # Hub dataset viewer maps "<split>-*.parquet" files to splits
+            shard_name = f"{self.split}-{self.shard_index:05d}.parquet"
+            shard_path = self.output_dir / shard_name
+            self.writer = pq.ParquetWriter(shard_path, self.schema)
+        table = pa.Table.from_pylist(self.rows, schema=self.schema)
+        self.writer.write_table(table)
+        self.shard_rows += len(self.rows)
+        self.total_rows += len(self.rows)
+        self.rows = []
+        if self.shard_rows >= self.max_rows:
+            self.close_shard()
+
+    def close_shard(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.shard_index += 1
+            self.shard_rows = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.close_shard()
@@ -1,15 +1,44 @@
+import hashlib
 import json
+import sqlite3
+import tempfile
+import pyarrow as pa
 from pathlib import Path
 from datasets import Dataset, DatasetDict
-from huggingface_hub import login
+from huggingface_hub import HfApi, login
 from sklearn.model_selection import train_test_split
+from typing import Iterator, Tuple
+from models.codec import item_to_dict
 from models.item import Item
+from dataset.shards import ParquetShardWriter, list_shards, open_shard
 from common.loggers import hf_dataset_upload_logger
 from common.constants import (
     HF_TOKEN,
     HF_PREPROCESSED_DATASET_REPO_ID,
 )
 
+# Streaming upload joins raw and processed items through an on-disk sqlite
+# index and writes parquet shards per split, so memory stays bounded
+SHOULD_STREAM_UPLOAD = False
+PARQUET_SHARDS_DIR = "dataset/parquet_shards"
+PARQUET_SHARD_ROWS = 100_000
+PARQUET_ROW_GROUP_SIZE = 10_000
+INDEX_INSERT_BATCH_SIZE = 10_000
+# Same 80/10/10 proportions as train_test_split in push_dataset_to_hub
+SPLIT_BUCKETS = [("train", 80), ("validation", 90), ("test", 100)]
+ITEM_SCHEMA = pa.schema(
+    [
+        ("item_id", pa.string()),
+        ("title", pa.string()),
+        ("category", pa.string()),
+        ("description", pa.string()),
+        ("price", pa.float64()),
+        ("summary", pa.string()),
+        ("prompt", pa.string()),
+        ("completion", pa.string()),
+    ]
+)
+
 
 class HFDatasetUploader:
 
@@ -22,8 +51,8 @@ class HFDatasetUploader:
     def read_raw_dataset(self, raw_dataset_dir: str) -> None:
         hf_dataset_upload_logger.info("Proceeding to read raw dataset")
         raw_dataset_dir = Path(raw_dataset_dir)
-        for file_path in raw_dataset_dir.glob("*.jsonl"):
-            with open(file_path, "r") as f:
+        for file_path in list_shards(raw_dataset_dir):
+            with open_shard(file_path, "rt") as f:
                 for line in f.readlines():
                     data = json.loads(line)
                     item_id = data["custom_id"]
@@ -37,14 +66,20 @@ class HFDatasetUploader:
     def read_processed_dataset(self, processed_dataset_dir: str) -> None:
         hf_dataset_upload_logger.info("Proceeding to read processed dataset")
         processed_dataset_dir = Path(processed_dataset_dir)
-        for file_path in processed_dataset_dir.glob("*.jsonl"):
-            with open(file_path, "r") as f:
+        for file_path in list_shards(processed_dataset_dir):
+            with open_shard(file_path, "rt") as f:
                 for line in f.readlines():
                     data = json.loads(line)
                     item_id = data["custom_id"]
                     content = data["response"]["body"]["choices"][0]["message"][
                         "content"
                     ]
+                    if item_id not in self.items:
+                        # Processed files must be migrated along with raw files
+                        hf_dataset_upload_logger.warning(
+                            f"No raw item found for processed item {item_id}"
+                        )
+                        continue
                     self.items[item_id].summary = content
         total_items = len(self.items.keys())
         hf_dataset_upload_logger.info(
@@ -55,7 +90,7 @@ class HFDatasetUploader:
         hf_dataset_upload_logger.info("Proceeding to create dataset")
         self.records = []
         for _, item_obj in self.items.items():
-            datapoint = item_obj.to_dict()
+            datapoint = item_to_dict(item_obj)
             self.records.append(datapoint)
         total_records = len(self.records)
         hf_dataset_upload_logger.info(f"Created dataset with {total_records} records")
@@ -98,11 +133,141 @@ class HFDatasetUploader:
         self.create_dataset()
         self.push_dataset_to_hub()
 
+    def iter_raw_records(self, raw_dataset_dir: str) -> Iterator[Tuple[str, str]]:
+        for file_path in list_shards(raw_dataset_dir):
+            with open_shard(file_path, "rt") as f:
+                for line in f:
+                    data = json.loads(line)
+                    product_data = data["body"]["messages"][1]["content"]
+                    yield data["custom_id"], product_data
+
+    def iter_processed_records(
+        self, processed_dataset_dir: str
+    ) -> Iterator[Tuple[str, str]]:
+        for file_path in list_shards(processed_dataset_dir):
+            with open_shard(file_path, "rt") as f:
+                for line in f:
+                    data = json.loads(line)
+                    content = data["response"]["body"]["choices"][0]["message"][
+                        "content"
+                    ]
+                    yield data["custom_id"], content
+
+    def insert_records(
+        self, connection: sqlite3.Connection, table: str, records: Iterator
+    ) -> None:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= INDEX_INSERT_BATCH_SIZE:
+                connection.executemany(
+                    f"INSERT OR REPLACE INTO {table} VALUES (?, ?)", batch
+                )
+                batch = []
+        connection.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?)", batch)
+        connection.commit()
+
+    def build_index(
+        self, index_path: str, raw_dataset_dir: str, processed_dataset_dir: str
+    ) -> sqlite3.Connection:
+        hf_dataset_upload_logger.info("Proceeding to index raw and processed dataset")
+        connection = sqlite3.connect(index_path)
+        connection.execute("CREATE TABLE raw (custom_id TEXT PRIMARY KEY, item TEXT)")
+        connection.execute(
+            "CREATE TABLE processed (custom_id TEXT PRIMARY KEY, summary TEXT)"
+        )
+        self.insert_records(connection, "raw", self.iter_raw_records(raw_dataset_dir))
+        self.insert_records(
+            connection, "processed", self.iter_processed_records(processed_dataset_dir)
+        )
+        return connection
+
+    def get_split(self, custom_id: str) -> str:
+        # Stable split per item, independent of the order items are read in
+        bucket = int(hashlib.sha1(custom_id.encode("utf-8")).hexdigest(), 16) % 100
+        for split, upper_bound in SPLIT_BUCKETS:
+            if bucket < upper_bound:
+                return split
+
+    def write_parquet_shards(
+        self, connection: sqlite3.Connection, output_dir: str
+    ) -> None:
+        hf_dataset_upload_logger.info("Proceeding to write parquet shards")
+        writers = {
+            split: ParquetShardWriter(
+                output_dir=output_dir,
+                split=split,
+                schema=ITEM_SCHEMA,
+                max_rows=PARQUET_SHARD_ROWS,
+                row_group_size=PARQUET_ROW_GROUP_SIZE,
+            )
+            for split, _ in SPLIT_BUCKETS
+        }
+        # sqlite streams the joined rows in custom_id order
+        rows = connection.execute(
+            "SELECT raw.custom_id, raw.item, processed.summary FROM raw "
+            "LEFT JOIN processed ON raw.custom_id = processed.custom_id "
+            "ORDER BY raw.custom_id"
+        )
+        for custom_id, product_data, summary in rows:
+            item = Item(**json.loads(product_data))
+            item.summary = summary
+            record = item_to_dict(item)
+            record["item_id"] = str(record["item_id"])
+            writers[self.get_split(custom_id)].write(record)
+
+        for split, writer in writers.items():
+            writer.close()
+            hf_dataset_upload_logger.info(
+                f"Wrote {writer.total_rows} {split} records "
+                f"in {writer.shard_index} parquet shards"
+            )
+
+    def push_parquet_shards_to_hub(self, output_dir: str) -> None:
+        login(token=HF_TOKEN, add_to_git_credential=True)
+        hf_api = HfApi()
+        hf_api.create_repo(
+            repo_id=self.repo_id,
+            repo_type="dataset",
+            private=self.private,
+            exist_ok=True,
+        )
+        hf_api.upload_folder(
+            folder_path=output_dir,
+            path_in_repo="data",
+            repo_id=self.repo_id,
+            repo_type="dataset",
+            delete_patterns=["*.parquet"],
+        )
+        hf_dataset_upload_logger.info(
+            "Successfully pushed parquet shards to huggingface"
+        )
+
+    def stream_upload(
+        self,
+        raw_dataset_dir: str,
+        processed_dataset_dir: str,
+        output_dir: str = PARQUET_SHARDS_DIR,
+    ) -> None:
+        for shard_path in Path(output_dir).glob("*.parquet"):
+            shard_path.unlink()
+        with tempfile.TemporaryDirectory() as index_dir:
+            connection = self.build_index(
+                index_path=str(Path(index_dir) / "index.sqlite3"),
+                raw_dataset_dir=raw_dataset_dir,
+                processed_dataset_dir=processed_dataset_dir,
+            )
+            try:
+                self.write_parquet_shards(connection, output_dir)
+            finally:
+                connection.close()
+        self.push_parquet_shards_to_hub(output_dir)
+
     def read_prompt_dataset(self, dataset_dir: str) -> None:
         hf_dataset_upload_logger.info("Proceeding to read simple dataset")
         dataset_dir = Path(dataset_dir)
-        for file_path in dataset_dir.glob("*.jsonl"):
-            with open(file_path, "r") as f:
+        for file_path in list_shards(dataset_dir):
+            with open_shard(file_path, "rt") as f:
                 for line in f.readlines():
                     data = json.loads(line)
                     item_id = data["item_id"]
@@ -125,7 +290,13 @@ if __name__ == "__main__":
         private=False,
     )
     # relative path wrt repo root
-    hf_dataset_uploader.upload(
-        raw_dataset_dir="dataset/batch_files",
-        processed_dataset_dir="dataset/preprocessed_batch_files",
-    )
+    if SHOULD_STREAM_UPLOAD:
+        hf_dataset_uploader.stream_upload(
+            raw_dataset_dir="dataset/batch_files",
+            processed_dataset_dir="dataset/preprocessed_batch_files",
+        )
+    else:
+        hf_dataset_uploader.upload(
+            raw_dataset_dir="dataset/batch_files",
+            processed_dataset_dir="dataset/preprocessed_batch_files",
+        )
@@ -2,7 +2,7 @@ import math
 import matplotlib.pyplot as plt
 from dataset.custom_dataset_downloader import download_custom_dataset
 from common.constants import HF_PREPROCESSED_DATASET_REPO_ID
-from models.item import Item
+from models.item_table import ItemTable
 
 GREEN = "\033[92m"
 YELLOW = "\033[93m"
@@ -12,9 +12,9 @@ COLOR_MAP = {"red": RED, "orange": YELLOW, "green": GREEN}
 
 dataset = download_custom_dataset(HF_PREPROCESSED_DATASET_REPO_ID)
 train_ds, val_ds, test_ds = dataset["train"], dataset["validation"], dataset["test"]
-train_ds = [Item(**datapoint) for datapoint in train_ds]
-val_ds = [Item(**datapoint) for datapoint in val_ds]
-test_ds = [Item(**datapoint) for datapoint in test_ds]
+train_ds = ItemTable.from_dataset(train_ds)
+val_ds = ItemTable.from_dataset(val_ds)
+test_ds = ItemTable.from_dataset(test_ds)
 
 
 class Tester:
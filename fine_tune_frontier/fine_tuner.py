@@ -1,7 +1,4 @@
-import json
-import random
 import time
-from typing import List
 from dataset.custom_dataset_downloader import download_custom_dataset
 from common.constants import (
     HF_PREPROCESSED_DATASET_REPO_ID,
@@ -9,6 +6,8 @@ from common.constants import (
 )
 from common.loggers import fine_tune_frontier_logger
 from models.item import Item
+from models.codec import encode_lines
+from models.item_table import ItemTable
 from fine_tune_frontier.constants import (
     FINE_TUNING_TRAIN_MAX_DATAPOINTS,
     FINE_TUNING_VAL_MAX_DATAPOINTS,
@@ -22,9 +21,9 @@ class FineTuneHandler:
 
     def __init__(
         self,
-        train_ds: List[Item],
-        val_ds: List[Item],
-        test_ds: List[Item],
+        train_ds: ItemTable,
+        val_ds: ItemTable,
+        test_ds: ItemTable,
         train_file_path: str,
         val_file_path: str,
         test_file_path: str,
@@ -44,23 +43,19 @@ class FineTuneHandler:
         self.val_file_id = None
         self.fine_tuned_model = None
 
-    def make_jsonl(self, item: Item) -> str:
+    def make_example(self, item: Item) -> dict:
         messages = [
             {"role": "user", "content": USER_PROMPT.format(summary=item.summary)},
             {"role": "assistant", "content": f"${item.price:.2f}"},
         ]
-        jsonl = {"messages": messages}
-        jsonl = json.dumps(jsonl)
-        return jsonl
+        return {"messages": messages}
 
-    def write_datapoints(self, items: List[Item], file_path: str) -> None:
+    def write_datapoints(self, items: ItemTable, file_path: str) -> None:
         fine_tune_frontier_logger.info(
             f"Proceeding to write {len(items)} items for fine tune training"
         )
-        with open(file_path, "w") as f:
-            for item in items:
-                jsonl = self.make_jsonl(item)
-                f.write(f"{jsonl}\n")
+        with open(file_path, "wb") as f:
+            f.write(encode_lines(self.make_example(item) for item in items))
         fine_tune_frontier_logger.info(
             f"Written {len(items)} items for fine tune training"
         )
@@ -137,13 +132,13 @@ class FineTuneHandler:
 if __name__ == "__main__":
     dataset = download_custom_dataset(HF_PREPROCESSED_DATASET_REPO_ID)
     train_ds, val_ds, test_ds = dataset["train"], dataset["validation"], dataset["test"]
-    train_ds = [Item(**datapoint) for datapoint in train_ds]
-    val_ds = [Item(**datapoint) for datapoint in val_ds]
-    test_ds = [Item(**datapoint) for datapoint in test_ds]
+    train_ds = ItemTable.from_dataset(train_ds)
+    val_ds = ItemTable.from_dataset(val_ds)
+    test_ds = ItemTable.from_dataset(test_ds)
 
-    random.shuffle(train_ds)
-    random.shuffle(val_ds)
-    random.shuffle(test_ds)
+    train_ds = train_ds.shuffle()
+    val_ds = val_ds.shuffle()
+    test_ds = test_ds.shuffle()
 
     fine_tune_handler = FineTuneHandler(
         train_ds=train_ds,
@@ -1,5 +1,3 @@
-import json
-from typing import List
 from pathlib import Path
 from dataset.custom_dataset_downloader import download_custom_dataset
 from dataset.upload_dataset import HFDatasetUploader
@@ -8,8 +6,9 @@ from common.constants import (
     HF_FINE_TUNE_OPEN_SOURCE_MODEL_DATASET_REPO_ID,
 )
 from common.loggers import fine_tune_open_source_logger
-from models.item import Item
-from transformers import AutoTokenizer
+from models.codec import encode_items
+from models.item_table import ItemTable
+from fine_tune_open_source.prompt_builder import PromptBuilder
 from fine_tune_open_source.constants import BASE_MODEL_NAME
 
 
@@ -17,9 +16,9 @@ class DatasetHandler:
 
     def __init__(
         self,
-        train_ds: List[Item],
-        val_ds: List[Item],
-        test_ds: List[Item],
+        train_ds: ItemTable,
+        val_ds: ItemTable,
+        test_ds: ItemTable,
         base_model_name: str,
         dataset_local_storage_path: str,
         target_dataset_repo_id: str,
@@ -31,24 +30,19 @@ class DatasetHandler:
         self.dataset_local_storage_path = dataset_local_storage_path
         self.target_dataset_repo_id = target_dataset_repo_id
 
-        self.tokenizer = AutoTokenizer.from_pretrained(self.base_model_name)
+        self.prompt_builder = PromptBuilder(tokenizer_name=self.base_model_name)
         self.records = []
 
     def add_prompts(self) -> None:
-        self.records = []
         complete_ds = self.train_ds + self.val_ds + self.test_ds
-        for item in complete_ds:
-            item.make_prompt(tokenizer=self.tokenizer)
-            self.records.append(item)
+        self.records = self.prompt_builder.add_prompts(complete_ds)
         fine_tune_open_source_logger.info(
             f"Added prompts and completion for {len(self.records)} items"
         )
 
     def save_to_local_storage(self) -> None:
-        with open(Path(self.dataset_local_storage_path) / "dataset.jsonl", "w") as f:
-            for item in self.records:
-                item = json.dumps(item.to_dict())
-                f.write(f"{item}\n")
+        with open(Path(self.dataset_local_storage_path) / "dataset.jsonl", "wb") as f:
+            f.write(encode_items(self.records))
         fine_tune_open_source_logger.info(
             f"Saved {len(self.records)} items to local storage"
         )
@@ -73,9 +67,9 @@ class DatasetHandler:
 if __name__ == "__main__":
     dataset = download_custom_dataset(HF_PREPROCESSED_DATASET_REPO_ID)
     train_ds, val_ds, test_ds = dataset["train"], dataset["validation"], dataset["test"]
-    train_ds = [Item(**datapoint) for datapoint in train_ds]
-    val_ds = [Item(**datapoint) for datapoint in val_ds]
-    test_ds = [Item(**datapoint) for datapoint in test_ds]
+    train_ds = ItemTable.from_dataset(train_ds)
+    val_ds = ItemTable.from_dataset(val_ds)
+    test_ds = ItemTable.from_dataset(test_ds)
 
     dataset_handler = DatasetHandler(
         train_ds=train_ds,
@@ -0,0 +1,89 @@
+import concurrent.futures
+import multiprocessing
+from typing import Any, Iterable, List, Optional
+from transformers import AutoTokenizer
+from models.item import MAX_TOKENS, Item
+
+PROMPT_BATCH_SIZE = 1000
+NUM_PROMPT_WORKERS = 1
+
+# Tokenizer of a worker process, loaded once by init_worker
+worker_tokenizer = None
+
+
+def truncate_texts(tokenizer: Any, texts: List[str], max_tokens: int) -> List[str]:
+    # Truncation happens in the fast tokenizer, the offset of the last kept
+    # token then gives the end of the truncated text, no decode is needed
+    encodings = tokenizer(
+        texts,
+        add_special_tokens=False,
+        truncation=True,
+        max_length=max_tokens,
+        return_offsets_mapping=True,
+        return_attention_mask=False,
+    )
+    truncated = []
+    for text, offsets in zip(texts, encodings["offset_mapping"]):
+        end = offsets[-1][1] if offsets else 0
+        truncated.append(text[:end].rstrip())
+    return truncated
+
+
+def init_worker(tokenizer_name: str) -> None:
+    global worker_tokenizer
+    worker_tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+
+
+def truncate_texts_in_worker(texts: List[str], max_tokens: int) -> List[str]:
+    return truncate_texts(worker_tokenizer, texts, max_tokens)
+
+
+class PromptBuilder:
+
+    def __init__(
+        self,
+        tokenizer_name: str,
+        max_tokens: int = MAX_TOKENS,
+        batch_size: int = PROMPT_BATCH_SIZE,
+        num_workers: int = NUM_PROMPT_WORKERS,
+    ) -> None:
+        self.tokenizer_name = tokenizer_name
+        self.max_tokens = max_tokens
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.tokenizer: Optional[Any] = None
+
+    def truncate(self, texts: List[str]) -> List[str]:
+        batches = [
+            texts[start : start + self.batch_size]
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        if self.num_workers > 1:
+            # spawn, since forking after the rust tokenizer has started its
+            # thread pool can deadlock
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(self.tokenizer_name,),
+            ) as ppx:
+                results = ppx.map(
+                    truncate_texts_in_worker,
+                    batches,
+                    [self.max_tokens] * len(batches),
+                )
+                return [text for batch in results for text in batch]
+
+        if self.tokenizer is None:
+            self.tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
+        truncated = []
+        for batch in batches:
+            truncated.extend(truncate_texts(self.tokenizer, batch, self.max_tokens))
+        return truncated
+
+    def add_prompts(self, items: Iterable[Item]) -> List[Item]:
+        items = list(items)
+        summaries = self.truncate([item.summary or "" for item in items])
+        for item, summary in zip(items, summaries):
+            item.set_prompt(summary)
+        return items
@@ -0,0 +1,67 @@
+import dataclasses
+import orjson
+from typing import Any, Iterable, List
+from models.item import Item
+
+ITEM_FIELDS = tuple(field.name for field in dataclasses.fields(Item))
+
+
+# orjson serialises the Item dataclass natively, without going through
+# dataclasses_json, and returns utf-8 bytes
+
+
+def item_to_dict(item: Item) -> dict:
+    return {field: getattr(item, field) for field in ITEM_FIELDS}
+
+
+def encode_item(item: Item) -> str:
+    return orjson.dumps(item).decode("utf-8")
+
+
+def decode_item(data: bytes) -> Item:
+    return Item(**orjson.loads(data))
+
+
+def encode_lines(records: Iterable[Any]) -> bytes:
+    # Whole list as JSON lines, with a trailing newline
+    return b"".join(orjson.dumps(record) + b"\n" for record in records)
+
+
+def decode_lines(data: bytes) -> List[Any]:
+    return [orjson.loads(line) for line in data.splitlines() if line.strip()]
+
+
+def encode_items(items: Iterable[Item]) -> bytes:
+    return encode_lines(items)
+
+
+def decode_items(data: bytes) -> List[Item]:
+    return [Item(**record) for record in decode_lines(data)]
+
+
+def make_batch_request(
+    custom_id: str, model: str, system_prompt: str, item: Item, max_tokens: int
+) -> dict:
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": encode_item(item)},
+            ],
+            "max_tokens": max_tokens,
+        },
+    }
+
+
+def encode_batch_request(
+    model: str, system_prompt: str, item: Item, max_tokens: int
+) -> str:
+    request = make_batch_request(
+        str(item.item_id), model, system_prompt, item, max_tokens
+    )
+    return orjson.dumps(request).decode("utf-8")
+
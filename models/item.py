@@ -6,7 +6,7 @@ MAX_TOKENS = 100
 
 
 @dataclass_json
-@dataclass
+@dataclass(slots=True)
 class Item:
 
     item_id: str
@@ -36,6 +36,9 @@ class Item:
         if len(tokens) > max_tokens:
             tokens = tokens[:max_tokens]
         summary = tokenizer.decode(tokens).rstrip()
+        self.set_prompt(summary)
+
+    def set_prompt(self, summary: str) -> None:
         # create prompt
         self.prompt = f"{self.question}\n{summary}\n{self.prefix}"
         # create completion
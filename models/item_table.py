@@ -0,0 +1,82 @@
+import numpy as np
+import pyarrow as pa
+from typing import Any, Iterable, Iterator, List, Optional, Union
+from models.codec import ITEM_FIELDS, item_to_dict
+from models.item import Item
+
+NUMERIC_TYPES = (pa.types.is_floating, pa.types.is_integer)
+
+
+class ItemTable:
+    # Items stored column wise in an arrow table. Slicing and concatenation
+    # are zero copy, numeric columns are exposed as numpy arrays and Item
+    # objects are only created for the rows that are accessed.
+
+    __slots__ = ("table",)
+
+    def __init__(self, table: pa.Table) -> None:
+        self.table = table
+
+    @classmethod
+    def from_dataset(cls, dataset: Any) -> "ItemTable":
+        # Huggingface Dataset split, the arrow format avoids python rows
+        return cls(dataset.with_format("arrow")[:])
+
+    @classmethod
+    def from_items(cls, items: Iterable[Item]) -> "ItemTable":
+        return cls(pa.Table.from_pylist([item_to_dict(item) for item in items]))
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def __getitem__(
+        self, index: Union[int, slice, List[int], np.ndarray]
+    ) -> Union[Item, "ItemTable"]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return ItemTable(self.table.slice(start, max(stop - start, 0)))
+            return ItemTable(self.table.take(np.arange(start, stop, step)))
+        if isinstance(index, (list, np.ndarray)):
+            return ItemTable(self.table.take(index))
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Index {index} out of range for {len(self)} items")
+        return self.make_item(self.table.slice(index, 1).to_pylist()[0])
+
+    def __iter__(self) -> Iterator[Item]:
+        for batch in self.table.to_batches():
+            for row in batch.to_pylist():
+                yield self.make_item(row)
+
+    def __add__(self, other: "ItemTable") -> "ItemTable":
+        if isinstance(other, list):
+            other = ItemTable.from_items(other)
+        return ItemTable(
+            pa.concat_tables([self.table, other.table], promote_options="default")
+        )
+
+    def __getattr__(self, name: str) -> Union[np.ndarray, List[Optional[str]]]:
+        # Column access, e.g. table.price (numpy array) or table.summary
+        if name not in ITEM_FIELDS or name not in self.table.column_names:
+            raise AttributeError(name)
+        return self.column(name)
+
+    def column(self, name: str) -> Union[np.ndarray, List[Any]]:
+        column = self.table.column(name)
+        if any(is_type(column.type) for is_type in NUMERIC_TYPES):
+            return column.to_numpy()
+        return column.to_pylist()
+
+    @staticmethod
+    def make_item(row: dict) -> Item:
+        return Item(**{key: row[key] for key in ITEM_FIELDS if key in row})
+
+    def shuffle(self, seed: Optional[int] = None) -> "ItemTable":
+        permutation = np.random.default_rng(seed).permutation(len(self))
+        return self[permutation]
+
+    def to_items(self) -> List[Item]:
+        return list(self)
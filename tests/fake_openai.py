@@ -0,0 +1,91 @@
+import itertools
+import json
+import threading
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+
+class FakeOpenAI:
+    # Local fake of the files and batches APIs used by the batch scheduler.
+    # A batch reports "in_progress" for `ticks` retrieves and then the next
+    # final status scripted for its input file ("completed" by default).
+    # Completed batches answer every request line with "summary of <id>".
+
+    def __init__(
+        self, ticks: int = 2, statuses: Optional[Dict[str, List[str]]] = None
+    ) -> None:
+        self.ticks = ticks
+        self.statuses = {name: list(s) for name, s in (statuses or {}).items()}
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.files_by_id: Dict[str, bytes] = {}
+        self.file_names: Dict[str, str] = {}
+        self.batches_by_id: Dict[str, dict] = {}
+        self.created: Dict[str, int] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.files = SimpleNamespace(create=self.create_file, content=self.get_content)
+        self.batches = SimpleNamespace(
+            create=self.create_batch, retrieve=self.retrieve_batch
+        )
+
+    def create_file(self, file: tuple, purpose: str) -> SimpleNamespace:
+        file_name, content = file
+        with self.lock:
+            file_id = f"file-{next(self.ids)}"
+            self.files_by_id[file_id] = content
+            self.file_names[file_id] = file_name
+        return SimpleNamespace(id=file_id)
+
+    def get_content(self, file_id: str) -> SimpleNamespace:
+        return SimpleNamespace(content=self.files_by_id[file_id])
+
+    def create_batch(
+        self, completion_window: str, endpoint: str, input_file_id: str
+    ) -> SimpleNamespace:
+        with self.lock:
+            batch_id = f"batch-{next(self.ids)}"
+            file_name = self.file_names[input_file_id]
+            statuses = self.statuses.get(file_name)
+            status = statuses.pop(0) if statuses else "completed"
+            self.batches_by_id[batch_id] = {
+                "input_file_id": input_file_id,
+                "status": status,
+                "polls": 0,
+            }
+            self.created[file_name] = self.created.get(file_name, 0) + 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return SimpleNamespace(id=batch_id)
+
+    def make_output(self, input_file_id: str) -> str:
+        lines = []
+        for line in self.files_by_id[input_file_id].decode("utf-8").splitlines():
+            custom_id = json.loads(line)["custom_id"]
+            body = {"choices": [{"message": {"content": f"summary of {custom_id}"}}]}
+            result = {
+                "id": None,
+                "custom_id": custom_id,
+                "response": {"status_code": 200, "body": body},
+                "error": None,
+            }
+            lines.append(json.dumps(result))
+        output_file_id = f"file-{next(self.ids)}"
+        self.files_by_id[output_file_id] = ("\n".join(lines) + "\n").encode("utf-8")
+        return output_file_id
+
+    def retrieve_batch(self, batch_id: str) -> SimpleNamespace:
+        with self.lock:
+            batch = self.batches_by_id[batch_id]
+            batch["polls"] += 1
+            if batch["polls"] <= self.ticks:
+                return SimpleNamespace(status="in_progress", errors=None)
+            if batch["polls"] == self.ticks + 1:
+                self.in_flight -= 1
+            if batch["status"] != "completed":
+                return SimpleNamespace(status=batch["status"], errors="scripted")
+            return SimpleNamespace(
+                status="completed",
+                errors=None,
+                output_file_id=self.make_output(batch["input_file_id"]),
+            )
@@ -0,0 +1,96 @@
+import json
+import pytest
+import dataset.batch_scheduler
+from dataset.batch_scheduler import BatchScheduler
+from tests.fake_openai import FakeOpenAI
+
+
+def make_batch_files(count: int, rows: int = 3) -> list:
+    batch_files = []
+    for index in range(count):
+        lines = [json.dumps({"custom_id": f"{index}-{row}"}) for row in range(rows)]
+        content = ("\n".join(lines) + "\n").encode("utf-8")
+        batch_files.append((f"file_{index}.jsonl", content, 100))
+    return batch_files
+
+
+def make_scheduler(client: FakeOpenAI, **kwargs) -> BatchScheduler:
+    return BatchScheduler(
+        openai_client=client, poll_interval=0.001, max_poll_interval=0.004, **kwargs
+    )
+
+
+def test_keeps_up_to_max_in_flight_batches_running():
+    client = FakeOpenAI(ticks=3)
+    results = {}
+    stats = make_scheduler(client, max_in_flight=2).run(
+        make_batch_files(5),
+        on_result=lambda file_name, content: results.update({file_name: content}),
+    )
+
+    assert client.max_in_flight == 2
+    assert stats == {"completed": 5, "failed": 0, "tokens": 500}
+    # 5 files with 2 in flight leave a trailing group of one, it runs too
+    assert sorted(results) == [f"file_{index}.jsonl" for index in range(5)]
+    lines = results["file_4.jsonl"].decode("utf-8").splitlines()
+    assert [json.loads(line)["custom_id"] for line in lines] == ["4-0", "4-1", "4-2"]
+
+
+def test_respects_in_flight_token_limit():
+    client = FakeOpenAI(ticks=3)
+    stats = make_scheduler(client, max_in_flight=4, max_in_flight_tokens=250).run(
+        make_batch_files(5), on_result=lambda file_name, content: None
+    )
+
+    assert client.max_in_flight == 2
+    assert stats["completed"] == 5
+
+
+def test_retries_failed_and_expired_batches_with_backoff(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(dataset.batch_scheduler.time, "sleep", sleeps.append)
+    client = FakeOpenAI(
+        ticks=5,
+        statuses={
+            "file_0.jsonl": ["failed", "completed"],
+            "file_1.jsonl": ["expired", "completed"],
+            "file_2.jsonl": ["failed", "failed", "failed"],
+            "file_3.jsonl": ["cancelled"],
+        },
+    )
+    results = []
+    scheduler = make_scheduler(client, max_in_flight=1, max_retries=2)
+    stats = scheduler.run(
+        make_batch_files(4),
+        on_result=lambda file_name, content: results.append(file_name),
+    )
+
+    assert results == ["file_0.jsonl", "file_1.jsonl"]
+    assert stats == {"completed": 2, "failed": 2, "tokens": 200}
+    # Failed and expired batches are created again, up to max_retries
+    # times, cancelled ones are not
+    assert client.created == {
+        "file_0.jsonl": 2,
+        "file_1.jsonl": 2,
+        "file_2.jsonl": 3,
+        "file_3.jsonl": 1,
+    }
+    # Polling backs off up to max_poll_interval
+    assert sleeps[:5] == pytest.approx([0.001, 0.0015, 0.00225, 0.003375, 0.004])
+    # Every batch polls `ticks` times, each of the 4 retries waits first
+    assert len(sleeps) == sum(client.created.values()) * client.ticks + 4
+
+
+def test_failing_on_result_does_not_stop_other_batches():
+    def on_result(file_name: str, content: bytes) -> None:
+        if file_name == "file_1.jsonl":
+            raise KeyError("unknown custom_id")
+        results.append(file_name)
+
+    results = []
+    stats = make_scheduler(FakeOpenAI(), max_in_flight=2).run(
+        make_batch_files(3), on_result=on_result
+    )
+
+    assert sorted(results) == ["file_0.jsonl", "file_2.jsonl"]
+    assert stats == {"completed": 2, "failed": 1, "tokens": 200}
@@ -0,0 +1,45 @@
+import json
+import pytest
+import utils.context_builder
+from utils.context_builder import ContextBuilder
+
+SUMMARY = "Title: Wireless speaker\nBrand: Acme\nFeatures: bluetooth, 20h battery"
+
+
+@pytest.fixture(autouse=True)
+def count_words_as_tokens(monkeypatch):
+    monkeypatch.setattr(
+        utils.context_builder, "count_tokens", lambda text: len(text.split())
+    )
+    utils.context_builder.parse_record.cache_clear()
+
+
+def make_record(summary: str, price: float) -> str:
+    return json.dumps({"summary": summary, "price": price})
+
+
+def test_drops_same_listing_at_near_equal_price():
+    records = [make_record(SUMMARY, 20.0), make_record(SUMMARY, 20.5)]
+    selected = ContextBuilder().select_records(records)
+
+    assert [parsed.price for parsed in selected] == [20.0]
+
+
+def test_keeps_same_listing_at_another_price():
+    records = [make_record(SUMMARY, 20.0), make_record(SUMMARY, 35.0)]
+    selected = ContextBuilder().select_records(records)
+
+    assert [parsed.price for parsed in selected] == [20.0, 35.0]
+
+
+def test_context_stays_within_budget():
+    records = [
+        make_record(f"{SUMMARY}\nColor: {index}", index + 1) for index in range(5)
+    ]
+    builder = ContextBuilder(token_budget=40)
+    context, tokens, tokens_saved = builder.build("bluetooth speaker", records)
+
+    assert tokens == len(context.split()) <= 40
+    assert tokens_saved > 0
+    # Every record that fits keeps its title and price
+    assert context.count("Title: Wireless speaker") == context.count("price is $")
@@ -0,0 +1,83 @@
+import sqlite3
+import threading
+import numpy as np
+from utils.embedding_cache import EmbeddingCache
+
+
+def encode_lengths(texts: list) -> np.ndarray:
+    return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+
+def test_encodes_only_texts_missed_by_both_tiers(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), "model")
+    encoded = []
+
+    def encode_fn(texts: list) -> np.ndarray:
+        encoded.extend(texts)
+        return encode_lengths(texts)
+
+    first = cache.encode(["a", "bb", "a"], encode_fn)
+    cache.close()
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), "model")
+    second = cache.encode(["bb", "ccc"], encode_fn)
+
+    assert encoded == ["a", "bb", "ccc"]
+    assert first.tolist() == [[1, 1], [2, 1], [1, 1]]
+    assert second.tolist() == [[2, 1], [3, 1]]
+    assert cache.hits == {"memory": 0, "disk": 1, "miss": 1}
+
+
+def test_concurrent_misses_encode_in_parallel(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), "model")
+    # Both calls have to be inside encode_fn at once to pass the barrier
+    barrier = threading.Barrier(2, timeout=5)
+
+    def encode_fn(texts: list) -> np.ndarray:
+        barrier.wait()
+        return encode_lengths(texts)
+
+    results = {}
+    threads = [
+        threading.Thread(
+            target=lambda text=text: results.update(
+                {text: cache.encode([text], encode_fn)}
+            )
+        )
+        for text in ["a", "bb"]
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not barrier.broken
+    assert results["a"].tolist() == [[1, 1]] and results["bb"].tolist() == [[2, 1]]
+
+
+def test_disk_hits_do_not_hold_the_write_lock(tmp_path):
+    cache_path = str(tmp_path / "cache.sqlite3")
+    cache = EmbeddingCache(cache_path, "model")
+    cache.encode(["a"], encode_lengths)
+    cache.close()
+
+    cache = EmbeddingCache(cache_path, "model")
+    cache.encode(["a"], encode_lengths)
+    assert cache.hits["disk"] == 1
+    # Another process sharing the file can write right away
+    other = sqlite3.connect(cache_path, timeout=0)
+    other.execute("DELETE FROM embeddings")
+    other.commit()
+
+
+def test_counts_entries_shared_with_other_processes(tmp_path):
+    cache_path = str(tmp_path / "cache.sqlite3")
+    caches = [EmbeddingCache(cache_path, "model", max_disk_entries=2) for _ in "ab"]
+    for cache in caches:
+        cache.encode(["a", "bb"], encode_lengths)
+        cache.flush()
+
+    # Both wrote the same two rows, so nothing is evicted
+    assert [len(cache) for cache in caches] == [2, 2]
+    caches[0].encode(["ccc"], encode_lengths)
+    caches[0].flush()
+    assert len(caches[0]) == 2
@@ -0,0 +1,70 @@
+import json
+import pytest
+import dataset.migrate_item_ids
+from dataset.migrate_item_ids import ID_MAPPING_FILE, ItemIdMigrator
+
+
+def make_raw_line(custom_id: str, title: str) -> str:
+    product = {"category": "Toys", "title": title, "description": "", "price": 9.99}
+    messages = [{"role": "system"}, {"role": "user", "content": json.dumps(product)}]
+    return json.dumps({"custom_id": custom_id, "body": {"messages": messages}})
+
+
+def make_processed_line(custom_id: str) -> str:
+    return json.dumps({"custom_id": custom_id, "response": {"status_code": 200}})
+
+
+def read_ids(directory) -> list:
+    return [
+        json.loads(line)["custom_id"]
+        for file_path in sorted(directory.glob("*.jsonl"))
+        for line in file_path.read_text().splitlines()
+    ]
+
+
+@pytest.fixture
+def dataset_dirs(tmp_path):
+    raw_dir, processed_dir = tmp_path / "raw", tmp_path / "processed"
+    raw_dir.mkdir()
+    processed_dir.mkdir()
+    # Items 1 and 2 have identical content
+    for name, rows in [("a", [("1", "car"), ("2", "car")]), ("b", [("3", "ball")])]:
+        lines = [make_raw_line(custom_id, title) for custom_id, title in rows]
+        (raw_dir / f"{name}.jsonl").write_text("\n".join(lines) + "\n")
+        lines = [make_processed_line(custom_id) for custom_id, _ in rows]
+        (processed_dir / f"{name}.jsonl").write_text("\n".join(lines) + "\n")
+    return raw_dir, processed_dir
+
+
+def test_migrates_raw_and_processed_files_to_the_same_ids(dataset_dirs):
+    raw_dir, processed_dir = dataset_dirs
+    ItemIdMigrator(str(raw_dir), str(processed_dir)).migrate()
+
+    raw_ids = read_ids(raw_dir)
+    assert len(set(raw_ids)) == 3 and not any(i.isdigit() for i in raw_ids)
+    assert read_ids(processed_dir) == raw_ids
+    assert not list(raw_dir.glob(f"*{ID_MAPPING_FILE}*"))
+
+
+def test_rerun_completes_an_interrupted_migration(dataset_dirs, monkeypatch):
+    raw_dir, processed_dir = dataset_dirs
+    replace = dataset.migrate_item_ids.os.replace
+    moved = []
+
+    def interrupted_replace(source, destination):
+        # Killed after the mapping and the first raw file were moved in place
+        if len(moved) == 2:
+            raise KeyboardInterrupt
+        moved.append(destination)
+        replace(source, destination)
+
+    monkeypatch.setattr(dataset.migrate_item_ids.os, "replace", interrupted_replace)
+    with pytest.raises(KeyboardInterrupt):
+        ItemIdMigrator(str(raw_dir), str(processed_dir)).migrate()
+    assert read_ids(processed_dir) == ["1", "2", "3"]
+
+    monkeypatch.setattr(dataset.migrate_item_ids.os, "replace", replace)
+    ItemIdMigrator(str(raw_dir), str(processed_dir)).migrate()
+    raw_ids = read_ids(raw_dir)
+    assert len(set(raw_ids)) == 3
+    assert read_ids(processed_dir) == raw_ids
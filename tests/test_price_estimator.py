@@ -0,0 +1,71 @@
+import json
+import pytest
+import utils.context_builder
+from utils.price_estimator import (
+    KNN_ROUTE,
+    LLM_ROUTE,
+    SHADOW_ROUTE,
+    KnnPriceEstimator,
+)
+
+
+@pytest.fixture(autouse=True)
+def count_words_as_tokens(monkeypatch):
+    # Records are parsed with their token counts, which are not under test
+    monkeypatch.setattr(
+        utils.context_builder, "count_tokens", lambda text: len(text.split())
+    )
+    utils.context_builder.parse_record.cache_clear()
+
+
+def make_records(prices: list) -> list:
+    return [
+        json.dumps({"summary": f"Title: product {index}", "price": price})
+        for index, price in enumerate(prices)
+    ]
+
+
+def test_tight_cluster_skips_the_llm():
+    estimator = KnnPriceEstimator(confidence_threshold=0.7, shadow_sample_rate=0)
+    price, confidence = estimator.estimate(
+        make_records([20.0, 20.5, 19.5, 20.0, 21.0]), [0.95, 0.93, 0.92, 0.9, 0.88]
+    )
+
+    assert price == pytest.approx(20.15, abs=0.1)
+    assert confidence >= 0.7
+    assert estimator.route(price, confidence) == KNN_ROUTE
+
+
+def test_spread_cluster_calls_the_llm():
+    estimator = KnnPriceEstimator(confidence_threshold=0.7, shadow_sample_rate=0)
+    price, confidence = estimator.estimate(
+        make_records([5.0, 80.0, 20.0, 300.0, 45.0]), [0.95, 0.93, 0.92, 0.9, 0.88]
+    )
+
+    assert confidence < 0.7
+    assert estimator.route(price, confidence) == LLM_ROUTE
+
+
+@pytest.mark.parametrize("prices", [[], [0.0, 0.0, 0.0]])
+def test_no_usable_prices_give_no_estimate(prices):
+    estimator = KnnPriceEstimator(confidence_threshold=0.7)
+    price, confidence = estimator.estimate(make_records(prices), [0.9] * len(prices))
+
+    assert (price, confidence) == (None, 0.0)
+    assert estimator.route(price, confidence) == LLM_ROUTE
+
+
+def test_every_estimate_is_shadowed_without_threshold():
+    estimator = KnnPriceEstimator()
+    price, confidence = estimator.estimate(
+        make_records([20.0, 20.5, 19.5]), [0.95, 0.75, 0.7]
+    )
+    assert estimator.route(price, confidence) == SHADOW_ROUTE
+    estimator.record_shadow(price, 25.0, confidence)
+
+    stats = estimator.get_stats()
+    assert stats["llm_skipped"] == 0
+    # Shadow stats are kept per confidence bucket, to choose a threshold from
+    assert stats["shadow_by_confidence"] == {
+        int(confidence * 10) / 10: (1, pytest.approx(abs(price - 25.0) / 25.0))
+    }
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from utils.index_snapshot import export_snapshot, import_snapshot, load_snapshot
+from utils.vector_store import NumpyVectorStore
+
+
+def make_rows(count: int, dimension: int = 16) -> tuple:
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(count, dimension)).astype(np.float32)
+    ids = [f"{row:064d}" for row in range(count)]
+    return ids, embeddings, [str(row) for row in range(count)]
+
+
+@pytest.mark.parametrize("storage", ["float16", "int8"])
+def test_quantized_store_rescores_against_float32_copy(tmp_path, storage):
+    ids, embeddings, documents = make_rows(500)
+    store = NumpyVectorStore(str(tmp_path), "products", storage)
+    store.upsert(ids=ids, embeddings=embeddings, documents=documents)
+    query = embeddings[:3] + 0.05
+
+    results, similarities = store.query_with_scores(query, 5)
+
+    normalised = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    queries = query / np.linalg.norm(query, axis=1, keepdims=True)
+    exact = queries @ normalised.T
+    for row, (result, scores) in enumerate(zip(results, similarities)):
+        expected = np.argsort(-exact[row])[:5]
+        assert result == [documents[index] for index in expected]
+        # Scores come from the float32 rows, not the quantized ones
+        assert scores == pytest.approx(exact[row][expected].tolist(), abs=1e-5)
+
+
+def test_snapshot_keeps_the_float32_copy(tmp_path):
+    ids, embeddings, documents = make_rows(50)
+    store = NumpyVectorStore(str(tmp_path / "a"), "products", "int8")
+    store.upsert(ids=ids, embeddings=embeddings, documents=documents)
+    export_snapshot(store, str(tmp_path / "index.snapshot"), "model")
+
+    restored = NumpyVectorStore(str(tmp_path / "b"), "products", "int8")
+    import_snapshot(load_snapshot(str(tmp_path / "index.snapshot"), "model"), restored)
+
+    assert np.array_equal(restored.full_embeddings, store.full_embeddings)
+    query = embeddings[:1]
+    assert restored.query_with_scores(query, 5) == store.query_with_scores(query, 5)
@@ -0,0 +1,168 @@
+import functools
+import json
+import re
+import threading
+from dataclasses import dataclass
+from common.tokens import count_tokens
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+# Tokens of the similar products' context in the user prompt
+CONTEXT_TOKEN_BUDGET = 300
+# Records whose summaries share at least this share of their words (jaccard)
+# with a more similar record, and whose prices are within this relative
+# difference of its price, are dropped
+NEAR_DUPLICATE_THRESHOLD = 0.8
+NEAR_DUPLICATE_PRICE_TOLERANCE = 0.05
+PARSED_RECORD_CACHE_SIZE = 10_000
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+# "Title: ...", "Brand: ..." etc. labels of the summary lines
+LINE_LABEL_PATTERN = re.compile(r"^\s*\w+:")
+
+
+@dataclass(frozen=True)
+class ParsedRecord:
+    lines: Tuple[str, ...]
+    line_words: Tuple[FrozenSet[str], ...]
+    line_tokens: Tuple[int, ...]
+    price: float
+    words: FrozenSet[str]
+    # Tokens of the record with its full summary and of the record with no
+    # summary lines, as formatted by format_record
+    full_tokens: int
+    empty_tokens: int
+
+
+def get_words(text: str) -> FrozenSet[str]:
+    return frozenset(WORD_PATTERN.findall(text.lower()))
+
+
+def format_record(lines: List[str], price: float) -> str:
+    summary = "\n".join(lines)
+    return f"Product summary\n{summary}\nprice is ${price}\n"
+
+
+@functools.lru_cache(maxsize=PARSED_RECORD_CACHE_SIZE)
+def parse_record(record: str) -> ParsedRecord:
+    # Stored documents never change, so they are parsed and tokenized once
+    data = json.loads(record)
+    lines = tuple(line.strip() for line in data["summary"].splitlines() if line.strip())
+    return ParsedRecord(
+        lines=lines,
+        line_words=tuple(get_words(LINE_LABEL_PATTERN.sub("", line)) for line in lines),
+        # The newline after each line is counted with it
+        line_tokens=tuple(count_tokens(line) + 1 for line in lines),
+        price=data["price"],
+        words=get_words(data["summary"]),
+        full_tokens=count_tokens(format_record([data["summary"]], data["price"])),
+        empty_tokens=count_tokens(format_record([], data["price"])),
+    )
+
+
+def is_near_duplicate(
+    record: ParsedRecord,
+    other: ParsedRecord,
+    threshold: float,
+    price_tolerance: float,
+) -> bool:
+    # The same product listed at a different price still tells the model
+    # something, so only records with near equal prices are duplicates
+    price_difference = abs(record.price - other.price)
+    if price_difference > price_tolerance * max(record.price, other.price):
+        return False
+    union = len(record.words | other.words)
+    return bool(union) and len(record.words & other.words) / union >= threshold
+
+
+class ContextBuilder:
+    # Context of similar products for the price prompt within a token
+    # budget. Near duplicate records (near equal summary and price) are
+    # dropped, every remaining record gets its first summary line (title)
+    # and price, in order of similarity, and the budget left is filled with
+    # the summary lines sharing the most words with the question per token.
+
+    def __init__(
+        self,
+        token_budget: int = CONTEXT_TOKEN_BUDGET,
+        near_duplicate_threshold: float = NEAR_DUPLICATE_THRESHOLD,
+        near_duplicate_price_tolerance: float = NEAR_DUPLICATE_PRICE_TOLERANCE,
+    ) -> None:
+        self.token_budget = token_budget
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.near_duplicate_price_tolerance = near_duplicate_price_tolerance
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "tokens": 0, "tokens_saved": 0, "dropped": 0}
+
+    def select_records(self, records: List[str]) -> List[ParsedRecord]:
+        selected = []
+        for record in records:
+            parsed = parse_record(record)
+            if not any(
+                is_near_duplicate(
+                    parsed,
+                    other,
+                    self.near_duplicate_threshold,
+                    self.near_duplicate_price_tolerance,
+                )
+                for other in selected
+            ):
+                selected.append(parsed)
+        return selected
+
+    def select_lines(
+        self, question: str, records: List[ParsedRecord]
+    ) -> List[Optional[List[int]]]:
+        # Indexes of the summary lines kept for each record, records that do
+        # not fit in the budget get None
+        used, selected_lines = 0, []
+        for parsed in records:
+            cost = parsed.empty_tokens + sum(parsed.line_tokens[:1])
+            if used + cost > self.token_budget:
+                selected_lines.append(None)
+                continue
+            used += cost
+            selected_lines.append([0] if parsed.lines else [])
+
+        question_words = get_words(question)
+        candidates = []
+        for index, parsed in enumerate(records):
+            if selected_lines[index] is None:
+                continue
+            for line_index in range(1, len(parsed.lines)):
+                shared = len(parsed.line_words[line_index] & question_words)
+                value = shared / parsed.line_tokens[line_index]
+                candidates.append((-value, index, line_index))
+        for _, index, line_index in sorted(candidates):
+            tokens = records[index].line_tokens[line_index]
+            if used + tokens <= self.token_budget:
+                used += tokens
+                selected_lines[index].append(line_index)
+        return selected_lines
+
+    def build(self, question: str, records: List[str]) -> tuple:
+        # Context, its tokens and the tokens saved over the full records
+        selected = self.select_records(records)
+        selected_lines = self.select_lines(question, selected)
+        context = "".join(
+            format_record([parsed.lines[line] for line in sorted(lines)], parsed.price)
+            for parsed, lines in zip(selected, selected_lines)
+            if lines is not None
+        )
+
+        tokens = count_tokens(context)
+        full_tokens = sum(parse_record(record).full_tokens for record in records)
+        with self.lock:
+            self.counts["requests"] += 1
+            self.counts["tokens"] += tokens
+            self.counts["tokens_saved"] += full_tokens - tokens
+            self.counts["dropped"] += len(records) - len(selected)
+        return context, tokens, full_tokens - tokens
+
+    def get_stats(self) -> Dict[str, float]:
+        with self.lock:
+            requests = self.counts["requests"]
+            return {
+                **self.counts,
+                "mean_tokens_saved": (
+                    self.counts["tokens_saved"] / requests if requests else 0.0
+                ),
+            }
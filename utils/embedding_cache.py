@@ -0,0 +1,191 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List
+
+MAX_MEMORY_ENTRIES = 10_000
+MAX_DISK_ENTRIES = 1_000_000
+SQLITE_MAX_VARIABLES = 900
+# New entries and last used times are written to disk (and the disk tier
+# trimmed) once this many are pending or this many seconds passed since the
+# last write
+DISK_COMMIT_ENTRIES = 1000
+DISK_COMMIT_INTERVAL = 5.0
+
+
+class EmbeddingCache:
+    # Two tier cache of embeddings keyed by (model name, sha256 of the text):
+    # an in-memory LRU in front of a sqlite store of float32 vectors. Both
+    # tiers evict their least recently used entries when full. Writes to disk
+    # are kept in memory and done in one short transaction per batch, so no
+    # write lock is held between calls (the file may be shared by several
+    # processes), flush (or close) writes the rest.
+
+    def __init__(
+        self,
+        cache_path: str,
+        model_name: str,
+        max_memory_entries: int = MAX_MEMORY_ENTRIES,
+        max_disk_entries: int = MAX_DISK_ENTRIES,
+    ) -> None:
+        self.cache_path = cache_path
+        self.model_name = model_name
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.hits = {"memory": 0, "disk": 0, "miss": 0}
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT, text_hash TEXT, embedding BLOB, last_used REAL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used "
+            "ON embeddings (last_used)"
+        )
+        self.connection.commit()
+        self.disk_entries = self.count_disk_entries()
+        # Embeddings not yet on disk and last used times of disk hits
+        self.pending: Dict[str, np.ndarray] = {}
+        self.touched: Dict[str, float] = {}
+        self.committed_at = time.time()
+
+    @staticmethod
+    def make_key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def remember(self, key: str, embedding: np.ndarray) -> None:
+        self.memory[key] = embedding
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def count_disk_entries(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_from_disk(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        # Only reads, the last used times of the hits are written by commit
+        results, now = {}, time.time()
+        for key in keys:
+            if key in self.pending:
+                results[key] = self.pending[key]
+        keys = [key for key in keys if key not in results]
+        for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+            chunk = keys[start : start + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.connection.execute(
+                "SELECT text_hash, embedding FROM embeddings "
+                f"WHERE model = ? AND text_hash IN ({placeholders})",
+                [self.model_name, *chunk],
+            )
+            for key, embedding in rows:
+                results[key] = np.frombuffer(embedding, dtype=np.float32)
+                self.touched[key] = now
+        return results
+
+    def put_on_disk(self, embeddings: Dict[str, np.ndarray]) -> None:
+        self.pending.update(embeddings)
+        self.maybe_commit()
+
+    def maybe_commit(self) -> None:
+        if (
+            len(self.pending) + len(self.touched) >= DISK_COMMIT_ENTRIES
+            or time.time() - self.committed_at >= DISK_COMMIT_INTERVAL
+        ):
+            self.commit()
+
+    def commit(self) -> None:
+        if self.pending or self.touched:
+            now = time.time()
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings "
+                "(model, text_hash, embedding, last_used) VALUES (?, ?, ?, ?)",
+                [
+                    (self.model_name, key, embedding.astype(np.float32).tobytes(), now)
+                    for key, embedding in self.pending.items()
+                ],
+            )
+            self.connection.executemany(
+                "UPDATE embeddings SET last_used = ? "
+                "WHERE model = ? AND text_hash = ?",
+                [
+                    (last_used, self.model_name, key)
+                    for key, last_used in self.touched.items()
+                ],
+            )
+            # Counted again, other processes sharing the file add (and
+            # replace) rows too
+            self.disk_entries = self.count_disk_entries()
+            excess = self.disk_entries - self.max_disk_entries
+            if excess > 0:
+                cursor = self.connection.execute(
+                    "DELETE FROM embeddings WHERE rowid IN ("
+                    "SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self.disk_entries -= cursor.rowcount
+            self.connection.commit()
+        self.pending, self.touched = {}, {}
+        self.committed_at = time.time()
+
+    def encode(
+        self, texts: List[str], encode_fn: Callable[[List[str]], Iterable]
+    ) -> np.ndarray:
+        # Embeddings of texts in input order, only texts found in neither
+        # tier are passed to encode_fn (once per distinct text)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        keys = [self.make_key(text) for text in texts]
+        with self.lock:
+            found = {}
+            for key in keys:
+                if key in self.memory and key not in found:
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+            self.hits["memory"] += len(found)
+
+            missing = list(dict.fromkeys(key for key in keys if key not in found))
+            from_disk = self.get_from_disk(missing) if missing else {}
+            self.hits["disk"] += len(from_disk)
+            for key, embedding in from_disk.items():
+                found[key] = embedding
+                self.remember(key, embedding)
+
+            missing = [key for key in missing if key not in from_disk]
+            self.hits["miss"] += len(missing)
+            if not missing:
+                self.maybe_commit()
+
+        # The model runs outside the lock, so that concurrent callers encode
+        # in parallel (a text missed by two of them is encoded by both)
+        if missing:
+            texts_by_key = dict(zip(keys, texts))
+            encoded = np.asarray(
+                encode_fn([texts_by_key[key] for key in missing]), dtype=np.float32
+            )
+            encoded = dict(zip(missing, encoded))
+            found.update(encoded)
+            with self.lock:
+                self.put_on_disk(encoded)
+                for key, embedding in encoded.items():
+                    self.remember(key, embedding)
+
+        return np.stack([found[key] for key in keys])
+
+    def __len__(self) -> int:
+        # Entries on disk as of the last write, and those waiting for the next
+        return self.disk_entries + len(self.pending)
+
+    def flush(self) -> None:
+        with self.lock:
+            self.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.commit()
+            self.connection.close()
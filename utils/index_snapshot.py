@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import struct
+import time
+import numpy as np
+from utils.vector_store import NumpyVectorStore, STORAGE_DTYPES, ID_DTYPE, OFFSET_DTYPE
+from typing import Any, Dict, Optional
+
+# Snapshot file layout: prefix (magic, version, header length), json header,
+# sections aligned to SNAPSHOT_ALIGNMENT bytes, sha256 of everything before
+# it. Section offsets in the header are relative to the end of the header.
+SNAPSHOT_MAGIC = b"AIPRIDX\x00"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_PREFIX = struct.Struct("<8sIQ")
+SNAPSHOT_ALIGNMENT = 64
+CHECKSUM_SIZE = hashlib.sha256().digest_size
+CHECKSUM_BLOCK_SIZE = 1 << 20
+SNAPSHOT_BATCH_SIZE = 5000
+
+
+def align(size: int) -> int:
+    return -(-size // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+
+class IndexSnapshot:
+    # Read only view of a snapshot file, sections are memory mapped
+
+    def __init__(self, snapshot_path: str, header: Dict[str, Any]) -> None:
+        self.snapshot_path = snapshot_path
+        self.header = header
+        self.sections = {
+            name: self.map_section(section)
+            for name, section in header["sections"].items()
+        }
+
+    def map_section(self, section: Dict[str, Any]) -> np.ndarray:
+        shape = tuple(section["shape"])
+        if not shape[0]:
+            return np.zeros(shape, dtype=section["dtype"])
+        return np.memmap(
+            self.snapshot_path,
+            dtype=np.dtype(section["dtype"]),
+            mode="r",
+            offset=self.header["data_offset"] + section["offset"],
+            shape=shape,
+        )
+
+    @property
+    def count(self) -> int:
+        return self.header["count"]
+
+    @property
+    def storage(self) -> str:
+        return self.header["storage"]
+
+    def document(self, row: int) -> str:
+        offsets, documents = self.sections["offsets"], self.sections["documents"]
+        start = offsets[row]
+        end = offsets[row + 1] if row + 1 < self.count else len(documents)
+        return documents[start:end].tobytes().decode("utf-8")
+
+    def rows(self, start: int, stop: int) -> tuple:
+        # Ids, float32 embeddings and documents of rows [start, stop)
+        if "full_embeddings" in self.sections:
+            embeddings = np.array(self.sections["full_embeddings"][start:stop])
+        else:
+            embeddings = self.sections["embeddings"][start:stop].astype(np.float32)
+            if "scales" in self.sections:
+                embeddings *= self.sections["scales"][start:stop][:, None]
+        ids = [
+            record_id.decode("ascii") for record_id in self.sections["ids"][start:stop]
+        ]
+        documents = [self.document(row) for row in range(start, stop)]
+        return ids, embeddings, documents
+
+
+def get_store_sections(vector_store: Any) -> tuple:
+    # Numpy stores are exported in their own storage format, other stores
+    # as float32 embeddings
+    if isinstance(vector_store, NumpyVectorStore):
+        sections = {
+            "embeddings": vector_store.embeddings,
+            "ids": vector_store.ids,
+            "offsets": vector_store.offsets,
+            "documents": vector_store.documents,
+        }
+        if vector_store.scales is not None:
+            sections["scales"] = vector_store.scales
+        if vector_store.full_embeddings is not None:
+            sections["full_embeddings"] = vector_store.full_embeddings
+        return sections, vector_store.storage
+
+    ids, embeddings, documents = [], [], []
+    for start in range(0, vector_store.count(), SNAPSHOT_BATCH_SIZE):
+        batch_ids, batch_embeddings, batch_documents = vector_store.get(
+            start, SNAPSHOT_BATCH_SIZE
+        )
+        ids.extend(batch_ids)
+        embeddings.append(batch_embeddings)
+        documents.extend(document.encode("utf-8") for document in batch_documents)
+    lengths = np.array([len(document) for document in documents], dtype=OFFSET_DTYPE)
+    sections = {
+        "embeddings": np.concatenate(embeddings).astype(np.float32),
+        "ids": np.array(ids, dtype=ID_DTYPE),
+        "offsets": (np.cumsum(lengths) - lengths).astype(OFFSET_DTYPE),
+        "documents": np.frombuffer(b"".join(documents), dtype=np.uint8),
+    }
+    return sections, "float32"
+
+
+def export_snapshot(
+    vector_store: Any, snapshot_path: str, model_name: str
+) -> Dict[str, Any]:
+    if not vector_store.count():
+        raise ValueError("Vector store is empty, there is nothing to export")
+    sections, storage = get_store_sections(vector_store)
+    count, dimension = sections["embeddings"].shape
+    header = {
+        "model_name": model_name,
+        "dimension": int(dimension),
+        "count": int(count),
+        "storage": storage,
+        "created_at": time.time(),
+        "sections": {},
+    }
+    offset = 0
+    for name, array in sections.items():
+        header["sections"][name] = {
+            "offset": offset,
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+        }
+        offset = align(offset + array.nbytes)
+    encoded_header = json.dumps(header).encode("utf-8")
+    prefix = SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(encoded_header))
+    header["data_offset"] = align(len(prefix) + len(encoded_header))
+
+    # Written to a partial file and moved in place, with the checksum of
+    # everything written before it at the end
+    checksum = hashlib.sha256()
+    partial_snapshot_path = f"{snapshot_path}.partial"
+    with open(partial_snapshot_path, "wb") as f:
+
+        def write(data: Any) -> None:
+            f.write(data)
+            checksum.update(data)
+
+        write(prefix + encoded_header)
+        for name, array in sections.items():
+            start = header["data_offset"] + header["sections"][name]["offset"]
+            write(b"\x00" * (start - f.tell()))
+            write(np.ascontiguousarray(array).data)
+        f.write(checksum.digest())
+    os.replace(partial_snapshot_path, snapshot_path)
+    return header
+
+
+def read_header(snapshot_path: str) -> Dict[str, Any]:
+    with open(snapshot_path, "rb") as f:
+        prefix = f.read(SNAPSHOT_PREFIX.size)
+        if len(prefix) < SNAPSHOT_PREFIX.size:
+            raise ValueError(f"{snapshot_path} is not an index snapshot")
+        magic, version, header_size = SNAPSHOT_PREFIX.unpack(prefix)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{snapshot_path} is not an index snapshot")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(
+                f"Index snapshot {snapshot_path} has version {version}, "
+                f"expected {SNAPSHOT_VERSION}"
+            )
+        header = json.loads(f.read(header_size))
+    header["data_offset"] = align(SNAPSHOT_PREFIX.size + header_size)
+    return header
+
+
+def verify_checksum(snapshot_path: str) -> None:
+    checksum = hashlib.sha256()
+    remaining = os.path.getsize(snapshot_path) - CHECKSUM_SIZE
+    with open(snapshot_path, "rb") as f:
+        while remaining > 0:
+            block = f.read(min(CHECKSUM_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            checksum.update(block)
+            remaining -= len(block)
+        expected = f.read(CHECKSUM_SIZE)
+    if remaining or checksum.digest() != expected:
+        raise ValueError(
+            f"Index snapshot {snapshot_path} is corrupt (checksum mismatch)"
+        )
+
+
+def load_snapshot(
+    snapshot_path: str,
+    model_name: str,
+    dimension: Optional[int] = None,
+    verify: bool = True,
+) -> IndexSnapshot:
+    # Embeddings of another model (or of another size) are meaningless for
+    # the queries of this one, so such snapshots are refused
+    header = read_header(snapshot_path)
+    if header["model_name"] != model_name:
+        raise ValueError(
+            f"Index snapshot {snapshot_path} was built with {header['model_name']}, "
+            f"expected {model_name}"
+        )
+    if dimension is not None and header["dimension"] != dimension:
+        raise ValueError(
+            f"Index snapshot {snapshot_path} has dimension {header['dimension']}, "
+            f"expected {dimension}"
+        )
+    if header["storage"] not in STORAGE_DTYPES:
+        raise ValueError(f"Index snapshot {snapshot_path} has unknown storage")
+    if verify:
+        verify_checksum(snapshot_path)
+    return IndexSnapshot(snapshot_path, header)
+
+
+def import_snapshot(
+    snapshot: IndexSnapshot, vector_store: Any, batch_size: int = SNAPSHOT_BATCH_SIZE
+) -> None:
+    # An empty numpy store of the same storage takes the sections as they
+    # are (quantized ones need the float32 copy too), anything else gets the
+    # rows upserted batch by batch
+    if (
+        isinstance(vector_store, NumpyVectorStore)
+        and not vector_store.count()
+        and vector_store.storage == snapshot.storage
+        and (snapshot.storage == "float32" or "full_embeddings" in snapshot.sections)
+    ):
+        vector_store.restore(**snapshot.sections)
+        return
+    for start in range(0, snapshot.count, batch_size):
+        ids, embeddings, documents = snapshot.rows(
+            start, min(start + batch_size, snapshot.count)
+        )
+        vector_store.upsert(ids=ids, embeddings=embeddings, documents=documents)
+
+
+if __name__ == "__main__":
+    # Exports the frontier agent's vector db (relative path wrt repo root),
+    # building it first if needed
+    from agents.frontier_agent import INDEX_SNAPSHOT_PATH, FrontierAgent
+
+    frontier_agent = FrontierAgent()
+    frontier_agent.rag_pipeline_handler.ensure_setup()
+    frontier_agent.vector_db_manager.export_snapshot(INDEX_SNAPSHOT_PATH)
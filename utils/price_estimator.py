@@ -0,0 +1,117 @@
+import random
+import threading
+from collections import defaultdict
+import numpy as np
+from utils.context_builder import parse_record
+from typing import Dict, List, Optional
+
+# Neighbours are weighted by their cosine similarity ** SIMILARITY_POWER, so
+# the closest ones dominate, and prices are averaged in log space
+SIMILARITY_POWER = 4
+# Weighted std of the neighbours' log prices at which confidence halves
+DISPERSION_SCALE = 0.15
+# Estimates at least this confident are returned without calling the llm.
+# None calls the llm for every request and shadows every estimate, until the
+# shadow stats per confidence show which threshold is safe to set
+CONFIDENCE_THRESHOLD = None
+# Share of confident requests that still call the llm, to measure how far
+# the estimates are from its prices
+SHADOW_SAMPLE_RATE = 0.05
+# Shadow stats are also kept per confidence bucket, [0, 0.1), [0.1, 0.2) etc.
+CONFIDENCE_BUCKETS = 10
+
+KNN_ROUTE = "knn"
+SHADOW_ROUTE = "shadow"
+LLM_ROUTE = "llm"
+
+
+class KnnPriceEstimator:
+    # Similarity weighted price of the retrieved neighbours with a confidence
+    # in [0, 1], which is the weighted similarity of the neighbours scaled
+    # down by the dispersion of their prices
+
+    def __init__(
+        self,
+        confidence_threshold: Optional[float] = CONFIDENCE_THRESHOLD,
+        shadow_sample_rate: float = SHADOW_SAMPLE_RATE,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.confidence_threshold = confidence_threshold
+        self.shadow_sample_rate = shadow_sample_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {route: 0 for route in [KNN_ROUTE, SHADOW_ROUTE, LLM_ROUTE]}
+        # Differences of the estimates to the llm prices of shadowed requests
+        self.shadow_samples = 0
+        self.shadow_abs_diff = 0.0
+        self.shadow_rel_diff = 0.0
+        # Samples and relative differences by lower bound of confidence bucket
+        self.bucket_samples: Dict[float, int] = defaultdict(int)
+        self.bucket_rel_diff: Dict[float, float] = defaultdict(float)
+
+    def estimate(self, records: List[str], similarities: List[float]) -> tuple:
+        # Price and confidence, (None, 0.0) without usable neighbours
+        prices = np.array([float(parse_record(record).price) for record in records])
+        similarities = np.clip(np.array(similarities, dtype=np.float64), 0, 1)
+        usable = prices > 0
+        if not usable.any() or not similarities[usable].any():
+            return None, 0.0
+
+        prices, similarities = prices[usable], similarities[usable]
+        weights = similarities**SIMILARITY_POWER
+        weights /= weights.sum()
+        log_prices = np.log(prices)
+        mean_log_price = float(weights @ log_prices)
+        dispersion = float(np.sqrt(weights @ (log_prices - mean_log_price) ** 2))
+        confidence = float(weights @ similarities) / (1 + dispersion / DISPERSION_SCALE)
+        return round(float(np.exp(mean_log_price)), 2), confidence
+
+    def route(self, price: Optional[float], confidence: float) -> str:
+        with self.lock:
+            if price is None:
+                route = LLM_ROUTE
+            elif self.confidence_threshold is None:
+                route = SHADOW_ROUTE
+            elif confidence < self.confidence_threshold:
+                route = LLM_ROUTE
+            elif self.random.random() < self.shadow_sample_rate:
+                route = SHADOW_ROUTE
+            else:
+                route = KNN_ROUTE
+            self.counts[route] += 1
+        return route
+
+    def record_shadow(self, price: float, llm_price: float, confidence: float) -> None:
+        rel_diff = abs(price - llm_price) / max(llm_price, 1.0)
+        bucket = (
+            min(int(confidence * CONFIDENCE_BUCKETS), CONFIDENCE_BUCKETS - 1)
+            / CONFIDENCE_BUCKETS
+        )
+        with self.lock:
+            self.shadow_samples += 1
+            self.shadow_abs_diff += abs(price - llm_price)
+            self.shadow_rel_diff += rel_diff
+            self.bucket_samples[bucket] += 1
+            self.bucket_rel_diff[bucket] += rel_diff
+
+    def get_stats(self) -> Dict[str, float]:
+        with self.lock:
+            requests = sum(self.counts.values())
+            samples = self.shadow_samples
+            return {
+                "requests": requests,
+                "llm_skipped": self.counts[KNN_ROUTE],
+                "hit_rate": self.counts[KNN_ROUTE] / requests if requests else 0.0,
+                "shadow_samples": samples,
+                "shadow_mean_abs_diff": (
+                    self.shadow_abs_diff / samples if samples else 0.0
+                ),
+                "shadow_mean_rel_diff": (
+                    self.shadow_rel_diff / samples if samples else 0.0
+                ),
+                # Samples and mean relative difference per confidence bucket
+                "shadow_by_confidence": {
+                    bucket: (count, self.bucket_rel_diff[bucket] / count)
+                    for bucket, count in sorted(self.bucket_samples.items())
+                },
+            }
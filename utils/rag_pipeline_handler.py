@@ -1,16 +1,42 @@
+import concurrent.futures
+import hashlib
+import itertools
 import json
 import os
 import re
-from chromadb import PersistentClient
-from sentence_transformers import SentenceTransformer
+import threading
+import time
+import numpy as np
 from openai import OpenAI
 from common.loggers import get_rotating_logger
-from typing import Any, List
-from dataset.custom_dataset_downloader import download_custom_dataset
+from utils.context_builder import CONTEXT_TOKEN_BUDGET, ContextBuilder
+from utils.embedding_cache import EmbeddingCache
+from utils.index_snapshot import export_snapshot, import_snapshot, load_snapshot
+from utils.price_estimator import (
+    CONFIDENCE_THRESHOLD,
+    KNN_ROUTE,
+    SHADOW_ROUTE,
+    KnnPriceEstimator,
+)
+from utils.vector_store import CHROMA_BACKEND, DEFAULT_STORAGE, make_vector_store
+from typing import Any, Dict, Iterable, List, Optional
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
 
+INGEST_CHUNK_SIZE = 1000
+INGEST_CHECKPOINT_FILE = "ingest_checkpoint.json"
+# Kept outside of the vector db directory, so that a rebuilt index reuses it
+EMBEDDING_CACHE_PATH = "embedding_cache.sqlite3"
+NUM_RELEVANT_RECORDS = 5
+CHAT_CONCURRENCY = 8
+# "chroma" or "numpy" (exact kNN over memory mapped embeddings)
+VECTOR_STORE_BACKEND = CHROMA_BACKEND
+# "float32" or "int8" embeddings (numpy backend only), "float16" works too but
+# its queries are slow
+VECTOR_STORE_STORAGE = DEFAULT_STORAGE
+WARMUP_QUERY = "Wireless bluetooth speaker with portable charging case"
+
 
 class VectorDbManager:
 
@@ -19,72 +45,220 @@ class VectorDbManager:
         vector_db_path: str,
         vector_db_collection_name: str,
         embedding_model_name: str,
+        embedding_cache_path: str = EMBEDDING_CACHE_PATH,
+        vector_store_backend: str = VECTOR_STORE_BACKEND,
+        vector_store_storage: str = VECTOR_STORE_STORAGE,
     ) -> None:
         self.vector_db_path = vector_db_path
         self.vector_db_collection_name = vector_db_collection_name
+        self.vector_store_backend = vector_store_backend
+        self.vector_store_storage = vector_store_storage
         self.logger = get_rotating_logger("vector_db_manager", "vector_db_manager.log")
         self.embedding_model_name = embedding_model_name
-        self.embedder = SentenceTransformer(self.embedding_model_name)
-        self.chroma_client = None
-        self.collection = None
+        self.embedding_cache = EmbeddingCache(
+            cache_path=embedding_cache_path, model_name=self.embedding_model_name
+        )
+        # Embedder and vector store are created once, on first use or by
+        # warmup, so that constructing the manager is cheap
+        self.embedder = None
+        self.vector_store = None
+        self.lock = threading.RLock()
+
+    def get_embedder(self) -> Any:
+        with self.lock:
+            if self.embedder is None:
+                started_at = time.perf_counter()
+                self.embedder = self.make_embedder()
+                self.logger.info(
+                    f"Loaded embedder {self.embedding_model_name} in "
+                    f"{time.perf_counter() - started_at:.2f}s"
+                )
+        return self.embedder
 
-        self.setup_vector_store()
-        assert self.chroma_client is not None
-        assert self.collection is not None
+    def get_vector_store(self) -> Any:
+        with self.lock:
+            if self.vector_store is None:
+                started_at = time.perf_counter()
+                self.setup_vector_store()
+                self.logger.info(
+                    f"Opened {self.vector_store_backend} vector store in "
+                    f"{time.perf_counter() - started_at:.2f}s"
+                )
+        return self.vector_store
+
+    def warmup(self) -> None:
+        # Eager loading for servers, otherwise everything loads on first use
+        started_at = time.perf_counter()
+        self.get_vector_store()
+        self.get_embedder().encode([WARMUP_QUERY])
+        self.logger.info(
+            f"Warmed up vector db manager in {time.perf_counter() - started_at:.2f}s"
+        )
+
+    def make_embedder(self) -> Any:
+        # Imported here, torch takes seconds to import
+        from sentence_transformers import SentenceTransformer
+
+        return SentenceTransformer(self.embedding_model_name)
 
     @property
     def is_data_ingested(self) -> bool:
-        return self.collection.count() > 0
+        # An interrupted ingestion leaves an incomplete checkpoint behind
+        checkpoint = self.read_ingest_checkpoint()
+        if checkpoint is not None and not checkpoint["completed"]:
+            return False
+        return self.get_vector_store().count() > 0
 
-    def vector_store_exists(self) -> bool:
-        db_exists = os.path.isdir(self.vector_db_path)
-        return db_exists and self.vector_db_collection_name in [
-            c.name
-            for c in PersistentClient(path=self.vector_db_path).list_collections()
-        ]
+    @property
+    def ingest_checkpoint_path(self) -> str:
+        return os.path.join(self.vector_db_path, INGEST_CHECKPOINT_FILE)
 
-    def create_vector_store(self) -> Any:
-        self.logger.info("Creating new vector store")
-        self.chroma_client = PersistentClient(path=self.vector_db_path)
-        self.collection = self.chroma_client.get_or_create_collection(
-            self.vector_db_collection_name
-        )
-        self.logger.info("Created new vector store")
+    def read_ingest_checkpoint(self) -> Optional[Dict[str, Any]]:
+        if not os.path.isfile(self.ingest_checkpoint_path):
+            return None
+        with open(self.ingest_checkpoint_path, "r") as f:
+            return json.load(f)
+
+    def write_ingest_checkpoint(
+        self, source: Optional[str], ingested: int, completed: bool
+    ) -> None:
+        checkpoint = {"source": source, "ingested": ingested, "completed": completed}
+        partial_checkpoint_path = f"{self.ingest_checkpoint_path}.partial"
+        with open(partial_checkpoint_path, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(partial_checkpoint_path, self.ingest_checkpoint_path)
+
+    def vector_store_exists(self) -> bool:
+        return self.get_vector_store().existed
 
     def setup_vector_store(self) -> None:
-        vector_store_exists = self.vector_store_exists()
-        if not vector_store_exists:
-            self.create_vector_store()
-        else:
+        # A single client opens (or creates) the collection
+        self.vector_store = make_vector_store(
+            self.vector_store_backend,
+            self.vector_db_path,
+            self.vector_db_collection_name,
+            self.vector_store_storage,
+        )
+        if self.vector_store.existed:
             self.logger.info("Vector store already exists")
-            self.chroma_client = PersistentClient(path=self.vector_db_path)
-            self.collection = self.chroma_client.get_or_create_collection(
-                self.vector_db_collection_name
-            )
+        else:
+            self.logger.info(f"Created new {self.vector_store_backend} vector store")
 
-    def embed(self, texts: List[str]) -> Any:
-        embeddings = self.embedder.encode(texts).tolist()
-        return embeddings
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self.embedding_cache.encode(texts, self.get_embedder().encode)
 
-    def ingest(self, records: List[str]) -> None:
-        ids, texts = [], []
-        for record_id, record in enumerate(records):
-            ids.append(str(record_id))
-            texts.append(json.dumps(record))
+    def get_embedding_dimension(self) -> int:
+        return int(self.embed([WARMUP_QUERY]).shape[1])
 
-        embeddings = self.embed(texts)
-        self.collection.add(ids=ids, embeddings=embeddings, documents=texts)
-        self.logger.info(f"Ingested {len(ids)} records in vector store")
+    def export_snapshot(self, snapshot_path: str) -> None:
+        started_at = time.perf_counter()
+        header = export_snapshot(
+            self.get_vector_store(), snapshot_path, self.embedding_model_name
+        )
+        self.logger.info(
+            f"Exported {header['count']} records ({header['storage']}) to index "
+            f"snapshot {snapshot_path} in {time.perf_counter() - started_at:.2f}s"
+        )
+
+    def import_snapshot(self, snapshot_path: str) -> None:
+        # Raises ValueError for a snapshot of another embedding model or
+        # dimension, or a corrupt one
+        started_at = time.perf_counter()
+        snapshot = load_snapshot(
+            snapshot_path, self.embedding_model_name, self.get_embedding_dimension()
+        )
+        import_snapshot(snapshot, self.get_vector_store())
+        self.write_ingest_checkpoint(snapshot_path, snapshot.count, completed=True)
+        self.logger.info(
+            f"Imported {snapshot.count} records from index snapshot "
+            f"{snapshot_path} in {time.perf_counter() - started_at:.2f}s"
+        )
+
+    @staticmethod
+    def make_record_id(text: str) -> str:
+        # Content hash, so ingesting the same record again is a no-op upsert
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def ingest_chunk(self, records: List[dict]) -> None:
+        # Duplicate ids within a single upsert are rejected by chroma
+        texts = {}
+        for record in records:
+            text = json.dumps(record)
+            texts[self.make_record_id(text)] = text
+        ids, documents = list(texts.keys()), list(texts.values())
+        embeddings = self.embed(documents)
+        self.get_vector_store().upsert(
+            ids=ids, embeddings=embeddings, documents=documents
+        )
+
+    def ingest(
+        self,
+        records: Iterable[dict],
+        source: Optional[str] = None,
+        total: Optional[int] = None,
+        chunk_size: int = INGEST_CHUNK_SIZE,
+    ) -> None:
+        # Records are embedded and upserted chunk by chunk, the checkpoint
+        # is updated after every chunk so that an interrupted ingestion of
+        # the same source resumes after the last upserted chunk
+        ingested = 0
+        checkpoint = self.read_ingest_checkpoint()
+        if (
+            checkpoint is not None
+            and not checkpoint["completed"]
+            and checkpoint["source"] == source
+        ):
+            ingested = checkpoint["ingested"]
+            self.logger.info(f"Resuming ingestion after {ingested} records")
+        records = itertools.islice(iter(records), ingested, None)
+
+        started_at = time.perf_counter()
+        resumed_at = ingested
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if not chunk:
+                break
+            self.ingest_chunk(chunk)
+            ingested += len(chunk)
+            self.write_ingest_checkpoint(source, ingested, completed=False)
+
+            elapsed = time.perf_counter() - started_at
+            rate = (ingested - resumed_at) / elapsed if elapsed else 0
+            progress = f"{ingested}/{total}" if total is not None else f"{ingested}"
+            self.logger.info(
+                f"Ingested {progress} records in vector store ({rate:.0f} records/s)"
+            )
+
+        self.embedding_cache.flush()
+        self.write_ingest_checkpoint(source, ingested, completed=True)
+        self.logger.info(
+            f"Finished ingestion of {ingested} records, "
+            f"{self.get_vector_store().count()} records in vector store"
+        )
 
     def get_relevant_records(self, query: str) -> List[str]:
-        query_embedding = self.embedder.encode(query).tolist()
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=5,
-            include=["documents"],
+        return self.get_relevant_records_with_scores(query)[0]
+
+    def get_relevant_records_with_scores(self, query: str) -> tuple:
+        # Records and their cosine similarities to the query
+        query_embedding = self.embed([query])
+        records, similarities = self.get_vector_store().query_with_scores(
+            query_embedding, NUM_RELEVANT_RECORDS
+        )
+        return records[0], similarities[0]
+
+    def get_relevant_records_batch(self, queries: List[str]) -> List[List[str]]:
+        return self.get_relevant_records_batch_with_scores(queries)[0]
+
+    def get_relevant_records_batch_with_scores(self, queries: List[str]) -> tuple:
+        # One encode call and one multi-embedding query for all queries,
+        # results are in the order of the queries
+        if not queries:
+            return [], []
+        query_embeddings = self.embed(queries)
+        return self.get_vector_store().query_with_scores(
+            query_embeddings, NUM_RELEVANT_RECORDS
         )
-        relevant_records = results["documents"][0]
-        return relevant_records
 
 
 class RagPipelineHandler:
@@ -101,15 +275,34 @@ class RagPipelineHandler:
         raw_dataset_name: str,
         vector_db_manager: VectorDbManager,
         chat_model_name: str,
+        index_snapshot_path: Optional[str] = None,
+        confidence_threshold: Optional[float] = CONFIDENCE_THRESHOLD,
+        context_token_budget: int = CONTEXT_TOKEN_BUDGET,
     ) -> None:
         self.raw_dataset_name = raw_dataset_name
         self.vector_db_manager = vector_db_manager
         self.chat_model_name = chat_model_name
+        self.index_snapshot_path = index_snapshot_path
+        # Confident estimates from the neighbours' prices skip the llm call
+        self.price_estimator = KnnPriceEstimator(confidence_threshold)
+        self.context_builder = ContextBuilder(context_token_budget)
         self.openai_client = OpenAI()
         self.logger = get_rotating_logger(
             "rag_pipeline_handler", "rag_pipeline_handler.log"
         )
-        self.setup()
+        # setup runs before the first lookup (or in warmup), not on construction
+        self.is_setup = False
+        self.lock = threading.Lock()
+
+    def ensure_setup(self) -> None:
+        with self.lock:
+            if not self.is_setup:
+                self.setup()
+                self.is_setup = True
+
+    def warmup(self) -> None:
+        self.ensure_setup()
+        self.vector_db_manager.warmup()
 
     def setup(self) -> None:
         self.logger.info("Setting up rag pipeline")
@@ -117,32 +310,62 @@ class RagPipelineHandler:
             self.logger.info("Vector db already exists with data ingested")
             return
 
+        # A fresh node loads the index snapshot, if there is one, instead of
+        # downloading and embedding the whole dataset
+        if self.index_snapshot_path and os.path.isfile(self.index_snapshot_path):
+            try:
+                self.vector_db_manager.import_snapshot(self.index_snapshot_path)
+                self.logger.info("Finished setting up rag pipeline from index snapshot")
+                return
+            except ValueError as exc:
+                self.logger.warning(f"Not using index snapshot, error: {exc}")
+
+        # Imported here, only a node without an ingested vector db needs it
+        from dataset.custom_dataset_downloader import download_custom_dataset
+
         dataset = download_custom_dataset(self.raw_dataset_name)
-        records = (
-            list(dataset["train"]) + list(dataset["validation"]) + list(dataset["test"])
+        splits = [dataset["train"], dataset["validation"], dataset["test"]]
+        self.vector_db_manager.ingest(
+            itertools.chain.from_iterable(splits),
+            source=self.raw_dataset_name,
+            total=sum(len(split) for split in splits),
         )
-        self.vector_db_manager.ingest(records)
         self.logger.info(
             "Finished setting up rag pipeline and ingested records into vector db"
         )
 
     def lookup(self, question: str) -> List[str]:
+        return self.lookup_with_scores(question)[0]
+
+    def lookup_with_scores(self, question: str) -> tuple:
+        self.ensure_setup()
         self.logger.info("Looking up relevant records")
-        relevant_records = self.vector_db_manager.get_relevant_records(question)
+        relevant_records, similarities = (
+            self.vector_db_manager.get_relevant_records_with_scores(question)
+        )
         self.logger.info(f"Got {len(relevant_records)} relevant records")
-        return relevant_records
+        return relevant_records, similarities
+
+    def lookup_batch(self, questions: List[str]) -> List[List[str]]:
+        return self.lookup_batch_with_scores(questions)[0]
+
+    def lookup_batch_with_scores(self, questions: List[str]) -> tuple:
+        self.ensure_setup()
+        self.logger.info(f"Looking up relevant records for {len(questions)} questions")
+        return self.vector_db_manager.get_relevant_records_batch_with_scores(questions)
 
     def get_messages(self, question: str) -> List[dict]:
+        return self.make_messages(question, self.lookup(question))
+
+    def make_messages(self, question: str, records: List[str]) -> List[dict]:
         user_prompt_content = f"Predict the price of this product\n{question}\n\n"
         user_prompt_content += "Here's some addtional context for similar products\n\n"
-
-        records = self.lookup(question)
-        for record in records:
-            record = json.loads(record)
-            summary = record["summary"]
-            price = record["price"]
-            text = f"Product summary\n{summary}\nprice is ${price}\n"
-            user_prompt_content += text
+        context, tokens, tokens_saved = self.context_builder.build(question, records)
+        user_prompt_content += context
+        self.logger.info(
+            f"Built context of {tokens} tokens from {len(records)} relevant "
+            f"records, {tokens_saved} tokens saved"
+        )
 
         messages = [
             {"role": "system", "content": self.system_prompt},
@@ -150,8 +373,69 @@ class RagPipelineHandler:
         ]
         return messages
 
-    def chat(self, question: str) -> str:
-        messages = self.get_messages(question)
+    def chat(self, question: str) -> float:
+        records, similarities = self.lookup_with_scores(question)
+        estimate, confidence = self.price_estimator.estimate(records, similarities)
+        route = self.price_estimator.route(estimate, confidence)
+        if route == KNN_ROUTE:
+            self.logger.info(
+                f"Estimated price ${estimate} from relevant records "
+                f"(confidence {confidence:.2f}), skipped llm call"
+            )
+            return estimate
+
+        price = self.predict_price(self.make_messages(question, records))
+        if route == SHADOW_ROUTE:
+            self.price_estimator.record_shadow(estimate, price, confidence)
+        return price
+
+    def chat_batch(
+        self, questions: List[str], max_workers: int = CHAT_CONCURRENCY
+    ) -> List[Optional[float]]:
+        # Prices in the order of the questions, None for a question whose
+        # completion failed or had no price in it. Only questions without a
+        # confident estimate (or shadowed ones) call the llm.
+        records, similarities = self.lookup_batch_with_scores(questions)
+        estimates = [
+            self.price_estimator.estimate(question_records, question_similarities)
+            for question_records, question_similarities in zip(records, similarities)
+        ]
+        routes = [
+            self.price_estimator.route(estimate, confidence)
+            for estimate, confidence in estimates
+        ]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as tpx:
+            futures = {
+                index: tpx.submit(
+                    self.predict_price,
+                    self.make_messages(questions[index], records[index]),
+                )
+                for index, route in enumerate(routes)
+                if route != KNN_ROUTE
+            }
+
+        prices = []
+        for index, (estimate, confidence) in enumerate(estimates):
+            if index not in futures:
+                prices.append(estimate)
+                continue
+            try:
+                price = futures[index].result()
+            except Exception as exc:
+                self.logger.error(f"Failed to price question {index}, error: {exc}")
+                prices.append(None)
+                continue
+            if routes[index] == SHADOW_ROUTE:
+                self.price_estimator.record_shadow(estimate, price, confidence)
+            prices.append(price)
+        failed = sum(1 for price in prices if price is None)
+        self.logger.info(
+            f"Priced {len(prices) - failed} questions "
+            f"({len(prices) - len(futures)} without llm call), {failed} failed"
+        )
+        return prices
+
+    def predict_price(self, messages: List[dict]) -> float:
         response = self.openai_client.chat.completions.create(
             messages=messages,
             model=self.chat_model_name,
@@ -0,0 +1,377 @@
+import json
+import os
+import numpy as np
+from typing import List, Optional
+
+CHROMA_BACKEND = "chroma"
+NUMPY_BACKEND = "numpy"
+VECTOR_STORE_BACKENDS = [CHROMA_BACKEND, NUMPY_BACKEND]
+
+NUMPY_STORE_META_FILE = "meta.json"
+NUMPY_STORE_EMBEDDINGS_FILE = "embeddings.bin"
+NUMPY_STORE_IDS_FILE = "ids.bin"
+NUMPY_STORE_OFFSETS_FILE = "offsets.bin"
+NUMPY_STORE_DOCUMENTS_FILE = "documents.bin"
+NUMPY_STORE_SCALES_FILE = "scales.bin"
+NUMPY_STORE_FULL_EMBEDDINGS_FILE = "embeddings_float32.bin"
+ID_DTYPE = np.dtype("S64")
+OFFSET_DTYPE = np.dtype(np.int64)
+
+# Embeddings are stored as float32, float16 or int8 with a float32 scale per
+# vector. Quantized stores are searched in chunks of SEARCH_CHUNK_ROWS rows
+# and the best n_results * RESCORE_FACTOR rows are rescored in full precision
+# against a float32 copy of the embeddings. The copy stays on disk (memory
+# mapped) and only the shortlisted rows are read, so quantization cuts the
+# memory searched per query, not the disk used. float16 is not recommended:
+# numpy casts it back to float32 slowly, which makes its queries several
+# times slower than float32 and int8.
+STORAGE_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+DEFAULT_STORAGE = "float32"
+SEARCH_CHUNK_ROWS = 4096
+RESCORE_FACTOR = 4
+
+
+class ChromaVectorStore:
+
+    def __init__(self, path: str, collection_name: str) -> None:
+        # Imported here, so that the numpy backend does not load chromadb
+        from chromadb import PersistentClient
+
+        self.path = path
+        self.collection_name = collection_name
+        self.existed = os.path.isdir(path)
+        self.client = PersistentClient(path=self.path)
+        self.existed = self.existed and collection_name in [
+            c.name for c in self.client.list_collections()
+        ]
+        self.collection = self.client.get_or_create_collection(self.collection_name)
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def upsert(
+        self, ids: List[str], embeddings: np.ndarray, documents: List[str]
+    ) -> None:
+        self.collection.upsert(
+            ids=ids, embeddings=embeddings.tolist(), documents=documents
+        )
+
+    def query(self, embeddings: np.ndarray, n_results: int) -> List[List[str]]:
+        results = self.collection.query(
+            query_embeddings=embeddings.tolist(),
+            n_results=n_results,
+            include=["documents"],
+        )
+        return results["documents"]
+
+    def query_with_scores(self, embeddings: np.ndarray, n_results: int) -> tuple:
+        # Documents and cosine similarities, converted from the squared l2
+        # distances of the collection (embeddings are normalised)
+        results = self.collection.query(
+            query_embeddings=embeddings.tolist(),
+            n_results=n_results,
+            include=["documents", "distances"],
+        )
+        similarities = [
+            [1 - distance / 2 for distance in distances]
+            for distances in results["distances"]
+        ]
+        return results["documents"], similarities
+
+    def get(self, offset: int, limit: int) -> tuple:
+        results = self.collection.get(
+            include=["embeddings", "documents"], offset=offset, limit=limit
+        )
+        embeddings = np.asarray(results["embeddings"], dtype=np.float32)
+        return results["ids"], embeddings, results["documents"]
+
+
+class NumpyVectorStore:
+    # Exact kNN over normalised embeddings kept in append-only files that
+    # are memory mapped for search. Documents are stored as utf-8 bytes with
+    # their start offsets, meta.json holds the number of committed rows and
+    # is replaced last, so rows of an interrupted upsert are ignored.
+
+    def __init__(
+        self, path: str, collection_name: str, storage: str = DEFAULT_STORAGE
+    ) -> None:
+        if storage not in STORAGE_DTYPES:
+            raise ValueError(
+                f"Unknown storage {storage}, expected one of {list(STORAGE_DTYPES)}"
+            )
+        self.path = path
+        self.collection_name = collection_name
+        self.store_dir = os.path.join(path, collection_name)
+        self.existed = self.exists(path, collection_name)
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.meta = self.read_meta(storage)
+        if self.meta["storage"] != storage:
+            raise ValueError(
+                f"Vector store {self.store_dir} uses {self.meta['storage']} "
+                f"storage, rebuild it to use {storage}"
+            )
+        self.storage = storage
+        self.load()
+        # Built once, upserts add their new ids to it
+        self.id_set = set(self.ids.tolist())
+
+    @staticmethod
+    def exists(path: str, collection_name: str) -> bool:
+        meta_path = os.path.join(path, collection_name, NUMPY_STORE_META_FILE)
+        return os.path.isfile(meta_path)
+
+    def file_path(self, file_name: str) -> str:
+        return os.path.join(self.store_dir, file_name)
+
+    def read_meta(self, storage: str) -> dict:
+        meta_path = self.file_path(NUMPY_STORE_META_FILE)
+        if not os.path.isfile(meta_path):
+            return {
+                "count": 0,
+                "dimension": None,
+                "documents_bytes": 0,
+                "storage": storage,
+            }
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        meta.setdefault("storage", DEFAULT_STORAGE)
+        return meta
+
+    def write_meta(self) -> None:
+        meta_path = self.file_path(NUMPY_STORE_META_FILE)
+        with open(f"{meta_path}.partial", "w") as f:
+            json.dump(self.meta, f)
+        os.replace(f"{meta_path}.partial", meta_path)
+
+    def map_file(self, file_name: str, dtype: np.dtype, shape: tuple) -> np.ndarray:
+        if not shape[0]:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self.file_path(file_name), dtype=dtype, mode="r", shape=shape)
+
+    def load(self) -> None:
+        count, dimension = self.meta["count"], self.meta["dimension"] or 0
+        self.embeddings = self.map_file(
+            NUMPY_STORE_EMBEDDINGS_FILE,
+            STORAGE_DTYPES[self.storage],
+            (count, dimension),
+        )
+        self.scales = None
+        if self.storage == "int8":
+            self.scales = self.map_file(NUMPY_STORE_SCALES_FILE, np.float32, (count,))
+        self.full_embeddings = None
+        if self.storage != "float32":
+            self.full_embeddings = self.map_file(
+                NUMPY_STORE_FULL_EMBEDDINGS_FILE, np.float32, (count, dimension)
+            )
+        self.ids = self.map_file(NUMPY_STORE_IDS_FILE, ID_DTYPE, (count,))
+        self.offsets = self.map_file(NUMPY_STORE_OFFSETS_FILE, OFFSET_DTYPE, (count,))
+        self.documents = self.map_file(
+            NUMPY_STORE_DOCUMENTS_FILE, np.uint8, (self.meta["documents_bytes"],)
+        )
+
+    def count(self) -> int:
+        return self.meta["count"]
+
+    def append(self, file_name: str, committed_bytes: int, data: bytes) -> None:
+        # Anything after the committed bytes is left over from an interrupted
+        # upsert and is overwritten
+        with open(self.file_path(file_name), "ab") as f:
+            f.truncate(committed_bytes)
+            f.write(data)
+
+    def quantize(self, embeddings: np.ndarray) -> tuple:
+        # Stored codes and per vector scales (None unless int8)
+        if self.storage != "int8":
+            return embeddings.astype(STORAGE_DTYPES[self.storage]), None
+        scales = np.abs(embeddings).max(axis=1) / 127
+        scales = np.maximum(scales, 1e-12).astype(np.float32)
+        codes = np.rint(embeddings / scales[:, None]).astype(np.int8)
+        return codes, scales
+
+    def upsert(
+        self, ids: List[str], embeddings: np.ndarray, documents: List[str]
+    ) -> None:
+        # Ids are content hashes, so a known id already holds the same
+        # document and is skipped
+        rows = [
+            index
+            for index, record_id in enumerate(ids)
+            if record_id.encode("ascii") not in self.id_set
+        ]
+        if not rows:
+            return
+
+        embeddings = np.asarray(embeddings, dtype=np.float32)[rows]
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.maximum(norms, 1e-12)
+        encoded_documents = [documents[index].encode("utf-8") for index in rows]
+        lengths = np.array([len(document) for document in encoded_documents])
+        offsets = self.meta["documents_bytes"] + np.cumsum(lengths) - lengths
+
+        count, dimension = self.meta["count"], embeddings.shape[1]
+        if self.meta["dimension"] not in (None, dimension):
+            raise ValueError(
+                f"Embedding dimension {dimension} does not match the store "
+                f"dimension {self.meta['dimension']}"
+            )
+        codes, scales = self.quantize(embeddings)
+        self.append(
+            NUMPY_STORE_EMBEDDINGS_FILE,
+            count * dimension * codes.itemsize,
+            codes.tobytes(),
+        )
+        if scales is not None:
+            self.append(
+                NUMPY_STORE_SCALES_FILE,
+                count * scales.itemsize,
+                scales.tobytes(),
+            )
+        if self.full_embeddings is not None:
+            self.append(
+                NUMPY_STORE_FULL_EMBEDDINGS_FILE,
+                count * dimension * embeddings.itemsize,
+                embeddings.tobytes(),
+            )
+        new_ids = np.array([ids[index] for index in rows], dtype=ID_DTYPE)
+        self.append(NUMPY_STORE_IDS_FILE, count * ID_DTYPE.itemsize, new_ids.tobytes())
+        self.append(
+            NUMPY_STORE_OFFSETS_FILE,
+            count * OFFSET_DTYPE.itemsize,
+            offsets.astype(OFFSET_DTYPE).tobytes(),
+        )
+        self.append(
+            NUMPY_STORE_DOCUMENTS_FILE,
+            self.meta["documents_bytes"],
+            b"".join(encoded_documents),
+        )
+        self.meta = {
+            "count": count + len(rows),
+            "dimension": dimension,
+            "documents_bytes": int(self.meta["documents_bytes"] + lengths.sum()),
+            "storage": self.storage,
+        }
+        self.write_meta()
+        self.load()
+        self.id_set.update(new_ids.tolist())
+
+    def restore(
+        self,
+        embeddings: np.ndarray,
+        ids: np.ndarray,
+        offsets: np.ndarray,
+        documents: np.ndarray,
+        scales: Optional[np.ndarray] = None,
+        full_embeddings: Optional[np.ndarray] = None,
+    ) -> None:
+        # Fills an empty store with rows already in its storage format (e.g.
+        # from an index snapshot), they are written as they are
+        if self.count():
+            raise ValueError(f"Vector store {self.store_dir} is not empty")
+        if (scales is not None) != (self.storage == "int8"):
+            raise ValueError("Scales are expected with (and only with) int8 storage")
+        if (full_embeddings is not None) != (self.storage != "float32"):
+            raise ValueError(
+                "Float32 embeddings are expected with (and only with) quantized "
+                "storage"
+            )
+        self.append(
+            NUMPY_STORE_EMBEDDINGS_FILE,
+            0,
+            embeddings.astype(STORAGE_DTYPES[self.storage], copy=False).data,
+        )
+        if scales is not None:
+            self.append(NUMPY_STORE_SCALES_FILE, 0, scales.data)
+        if full_embeddings is not None:
+            self.append(
+                NUMPY_STORE_FULL_EMBEDDINGS_FILE,
+                0,
+                full_embeddings.astype(np.float32, copy=False).data,
+            )
+        self.append(NUMPY_STORE_IDS_FILE, 0, ids.data)
+        self.append(NUMPY_STORE_OFFSETS_FILE, 0, offsets.data)
+        self.append(NUMPY_STORE_DOCUMENTS_FILE, 0, documents.data)
+        self.meta = {
+            "count": len(ids),
+            "dimension": int(embeddings.shape[1]) if len(ids) else None,
+            "documents_bytes": len(documents),
+            "storage": self.storage,
+        }
+        self.write_meta()
+        self.load()
+        self.id_set = set(self.ids.tolist())
+
+    def document(self, row: int) -> str:
+        start = self.offsets[row]
+        end = self.offsets[row + 1] if row + 1 < len(self.offsets) else None
+        end = self.meta["documents_bytes"] if end is None else end
+        return self.documents[start:end].tobytes().decode("utf-8")
+
+    def query(self, embeddings: np.ndarray, n_results: int) -> List[List[str]]:
+        return self.query_with_scores(embeddings, n_results)[0]
+
+    def query_with_scores(self, embeddings: np.ndarray, n_results: int) -> tuple:
+        # Documents and their cosine similarities, most similar first
+        queries = np.asarray(embeddings, dtype=np.float32)
+        queries = queries / np.maximum(
+            np.linalg.norm(queries, axis=1, keepdims=True), 1e-12
+        )
+        n_results = min(n_results, self.count())
+        if not n_results:
+            return [[] for _ in queries], [[] for _ in queries]
+
+        # Cosine similarity of every stored embedding with every query
+        scores = self.scores(queries)
+        shortlist_size = n_results
+        if self.storage != "float32":
+            shortlist_size = min(n_results * RESCORE_FACTOR, self.count())
+
+        results, similarities = [], []
+        for query, column in zip(queries, scores.T):
+            top = np.argpartition(-column, shortlist_size - 1)[:shortlist_size]
+            column = column[top]
+            if self.storage != "float32":
+                column = self.rescore(top, query)
+                best = np.argpartition(-column, n_results - 1)[:n_results]
+                top, column = top[best], column[best]
+            order = np.argsort(-column)
+            results.append([self.document(row) for row in top[order]])
+            similarities.append(column[order].tolist())
+        return results, similarities
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        if self.storage == "float32":
+            return self.embeddings @ queries.T
+        # Quantized rows are cast chunk by chunk into one buffer, so memory
+        # stays bounded
+        scores = np.empty((self.count(), len(queries)), dtype=np.float32)
+        buffer = np.empty(
+            (min(SEARCH_CHUNK_ROWS, self.count()), self.embeddings.shape[1]),
+            dtype=np.float32,
+        )
+        for start in range(0, self.count(), SEARCH_CHUNK_ROWS):
+            chunk = self.embeddings[start : start + SEARCH_CHUNK_ROWS]
+            np.copyto(buffer[: len(chunk)], chunk)
+            chunk_scores = buffer[: len(chunk)] @ queries.T
+            if self.scales is not None:
+                chunk_scores *= self.scales[start : start + len(chunk)][:, None]
+            scores[start : start + len(chunk)] = chunk_scores
+        return scores
+
+    def rescore(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        # Cosine similarity with the float32 copy of the (normalised) rows
+        return self.full_embeddings[rows] @ query
+
+
+def make_vector_store(
+    backend: str, path: str, collection_name: str, storage: str = DEFAULT_STORAGE
+) -> object:
+    if backend == CHROMA_BACKEND:
+        if storage != DEFAULT_STORAGE:
+            raise ValueError(f"{backend} vector store only supports float32 storage")
+        return ChromaVectorStore(path, collection_name)
+    if backend == NUMPY_BACKEND:
+        return NumpyVectorStore(path, collection_name, storage)
+    raise ValueError(
+        f"Unknown vector store backend {backend}, expected one of "
+        f"{VECTOR_STORE_BACKENDS}"
+    )